@@ -1,15 +1,42 @@
 import os
 import re
+import asyncio
+import threading
 import time
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import sqlite3
+import unicodedata
+import atexit
 import chardet
+import codecs
+import hashlib
+import mmap
+import shutil
+import tempfile
+import math
+import random
 import traceback
+from array import array
+from xml.parsers import expat
+from xml.sax.saxutils import escape as xml_escape, unescape as xml_unescape
+from collections import Counter, deque
+from email.utils import parsedate_to_datetime
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import argparse
 import sys
 
+try:
+    import aiohttp
+except ImportError:  # 未安装 aiohttp 时，异步引擎改用线程池发送请求
+    aiohttp = None
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，备份不尝试 reflink
+    fcntl = None
+
 if getattr(sys, 'frozen', False):
     # 打包后使用exe所在目录
     script_dir = os.path.dirname(sys.executable)
@@ -18,15 +45,213 @@ else:
     script_dir = os.path.dirname(__file__)
 
 output_folder = os.path.join(script_dir, "翻译")
-BACKUP_FOLDER = os.path.join(script_dir, "翻译备份")
+BACKUP_FOLDER = os.path.join(script_dir, "翻译备份")  # 按 mod 目录结构存放最近一次备份，内容实际存于其中的 objects
+FICLONE = 0x40049409  # Linux 的 reflink ioctl，Btrfs/XFS 等文件系统上复制不占额外空间
 CONFIG_FILE = os.path.join(script_dir, "api_config.json")
 MAX_RETRIES = 3
-REQUEST_DELAY = 4.0
+REQUEST_DELAY = 4.0  # 重试退避的基础等待秒数
+MAX_RETRY_DELAY = 30.0
+REQUESTS_PER_MINUTE = 600  # 每个密钥的默认配额，可在 api_config.json 中覆盖
+TOKENS_PER_MINUTE = 1000000
+RATE_BURST_SECONDS = 5  # 令牌桶最多积攒的秒数
+RATE_RECOVERY_STEP = 0.05  # 每次成功后恢复的速率比例
+MIN_RATE_SCALE = 0.05
+KEY_MAX_FAILURES = 5  # 密钥连续失败该次数后熔断
+BREAKER_COOLDOWN = 30.0  # 熔断后首次冷却秒数，探测失败后加倍
+BREAKER_MAX_COOLDOWN = 600.0
+BREAKER_AUTH_COOLDOWN = 600.0  # 401/403 的冷却秒数
+BREAKER_MAX_WAIT = 120.0  # 所有密钥都需要等待超过该秒数才能恢复时，剩余条目保留原文
+STRAGGLER_PERCENTILE = 0.95  # 批次执行超过近期请求耗时该分位数的 STRAGGLER_FACTOR 倍时允许空闲密钥重复领取
+STRAGGLER_FACTOR = 1.5
+STRAGGLER_MIN_SAMPLES = 20  # 成功请求少于该数时不重复领取：耗时分布未知，重复只会多花一份钱
+LATENCY_WINDOW = 200  # 统计耗时分位数的最近成功请求数
+STRAGGLER_CHECK_SECONDS = 1.0
 TIMEOUT_SECONDS = 55
+FILE_WORKERS = 4  # 同时读取、解析和写回的文件数，翻译请求不占用这些线程
+KEY_CONCURRENCY = 16  # 每个密钥同时在途的请求数，也是其连接池大小，可用 --key-concurrency 覆盖
 TRANSLATABLE_TAGS = ["DisplayName", "Description", "Tooltip", "value"]
 SKIP_KEYWORDS = ["DisplayName", "Item", "Description", "Group"]
-CACHE_FILE = os.path.join(script_dir, "translation_cache.json")
+CACHE_FILE = os.path.join(script_dir, "translation_cache.json")  # 旧版缓存，首次运行时迁移到 CACHE_DB_FILE
+CACHE_DB_FILE = os.path.join(script_dir, "translation_cache.db")
+CACHE_FLUSH_INTERVAL = 5.0  # 缓存缓冲区写入磁盘的间隔秒数
+CACHE_FLUSH_SIZE = 500  # 缓冲区达到该条目数时立即写入
+FOLD_TAGS = False  # 为 True 时按 TAG_FOLDING 合并标签的缓存条目，可用 --fold-tags 开启
+TAG_FOLDING = {"Tooltip": "DisplayName"}
+TEMPLATE_CACHE = True  # 数字、尺寸、版本号不同的条目共用一个模板译文，可用 --no-template-cache 关闭
+FUZZY_MEMORY = True  # 用相似原文的已有译文做参考或直接复用，可用 --no-fuzzy-memory 关闭
+TM_REUSE_THRESHOLD = 0.97  # 相似度达到该值且标签相同时直接复用译文
+TM_HINT_THRESHOLD = 0.6  # 相似度达到该值时作为参考译文放入提示词
+TM_MAX_HINTS = 5
+TM_MAX_CHARS = 1000  # 超过该长度的原文不进入索引
+TM_MAX_POSTING = 2000  # 倒排表长度超过该值的常见三元组不参与候选筛选
+TM_MAX_SCAN = 2500  # 每次查询最多累计扫描的倒排表条目数，保证单次查询耗时有上限
+TM_MAX_CANDIDATES = 10
+PARSE_CHUNK_SIZE = 1024 * 1024  # 流式解析每次读取的字节数
+PARSER_VERSION = 1  # 解析或写回方式改变时递增，清单中旧版本的记录随之失效
+MANIFEST_FILE = os.path.join(script_dir, "translation_manifest.json")
+JOURNAL_FILE = os.path.join(script_dir, "translation_journal.jsonl")  # 运行中断后供 --resume 使用，正常结束时删除
+MMAP_THRESHOLD = 16 * 1024 * 1024  # 超过该大小的文件以内存映射读取
+GLOSSARY_FILE = os.path.join(script_dir, "glossary.json")  # 用户术语表，可用 --glossary 指定
+# 游戏原版常用术语，整条命中时不再请求 API
+DEFAULT_GLOSSARY = {
+    "Steel Plate": "钢板",
+    "Interior Plate": "内衬板",
+    "Construction Component": "结构零件",
+    "Metal Grid": "金属网格",
+    "Large Steel Tube": "大型钢管",
+    "Small Steel Tube": "小型钢管",
+    "Motor": "马达",
+    "Computer": "计算机",
+    "Display": "显示器",
+    "Girder": "梁",
+    "Bulletproof Glass": "防弹玻璃",
+    "Power Cell": "动力电池",
+    "Solar Cell": "太阳能电池",
+    "Reactor Component": "反应堆零件",
+    "Thruster Component": "推进器零件",
+    "Gravity Generator Component": "重力发生器零件",
+    "Medical Component": "医疗零件",
+    "Radio-communication Component": "无线电通信零件",
+    "Detector Component": "探测器零件",
+    "Superconductor": "超导体",
+    "Explosives": "炸药",
+    "Zone Chip": "区域芯片",
+    "Canvas": "帆布",
+    "Stone": "石头",
+    "Ice": "冰",
+    "Gravel": "砾石",
+    "Iron Ore": "铁矿石",
+    "Nickel Ore": "镍矿石",
+    "Cobalt Ore": "钴矿石",
+    "Magnesium Ore": "镁矿石",
+    "Silicon Ore": "硅矿石",
+    "Silver Ore": "银矿石",
+    "Gold Ore": "金矿石",
+    "Platinum Ore": "铂矿石",
+    "Uranium Ore": "铀矿石",
+    "Iron Ingot": "铁锭",
+    "Nickel Ingot": "镍锭",
+    "Cobalt Ingot": "钴锭",
+    "Magnesium Powder": "镁粉",
+    "Silicon Wafer": "硅片",
+    "Silver Ingot": "银锭",
+    "Gold Ingot": "金锭",
+    "Platinum Ingot": "铂锭",
+    "Uranium Ingot": "铀锭",
+    "Light Armor Block": "轻型装甲块",
+    "Heavy Armor Block": "重型装甲块",
+    "Refinery": "精炼厂",
+    "Basic Refinery": "基础精炼厂",
+    "Assembler": "装配机",
+    "Basic Assembler": "基础装配机",
+    "Survival Kit": "生存舱",
+    "Medical Room": "医疗室",
+    "Cryo Chamber": "冷冻舱",
+    "Oxygen Generator": "氧气发生器",
+    "O2/H2 Generator": "氢氧发生器",
+    "Oxygen Tank": "氧气罐",
+    "Hydrogen Tank": "氢气罐",
+    "Oxygen Farm": "氧气农场",
+    "Air Vent": "通风口",
+    "Hydrogen Engine": "氢气发动机",
+    "Small Reactor": "小型反应堆",
+    "Large Reactor": "大型反应堆",
+    "Battery": "电池",
+    "Solar Panel": "太阳能板",
+    "Wind Turbine": "风力涡轮机",
+    "Ion Thruster": "离子推进器",
+    "Hydrogen Thruster": "氢气推进器",
+    "Atmospheric Thruster": "大气推进器",
+    "Gyroscope": "陀螺仪",
+    "Jump Drive": "跃迁引擎",
+    "Gravity Generator": "重力发生器",
+    "Spherical Gravity Generator": "球形重力发生器",
+    "Artificial Mass": "人造质量块",
+    "Cargo Container": "货箱",
+    "Small Cargo Container": "小型货箱",
+    "Medium Cargo Container": "中型货箱",
+    "Large Cargo Container": "大型货箱",
+    "Connector": "连接器",
+    "Collector": "收集器",
+    "Ejector": "弹射器",
+    "Conveyor": "传送带",
+    "Conveyor Tube": "传送管",
+    "Conveyor Junction": "传送带交汇点",
+    "Conveyor Sorter": "传送带分拣器",
+    "Merge Block": "合并块",
+    "Landing Gear": "起落架",
+    "Magnetic Plate": "磁力板",
+    "Rotor": "转子",
+    "Advanced Rotor": "高级转子",
+    "Hinge": "铰链",
+    "Piston": "活塞",
+    "Wheel Suspension": "车轮悬挂",
+    "Drill": "钻头",
+    "Welder": "焊接器",
+    "Grinder": "切割机",
+    "Hand Drill": "手钻",
+    "Projector": "投影仪",
+    "Programmable Block": "编程块",
+    "Timer Block": "定时器",
+    "Event Controller": "事件控制器",
+    "Sensor": "传感器",
+    "Button Panel": "按钮面板",
+    "LCD Panel": "LCD 面板",
+    "Text Panel": "文本面板",
+    "Antenna": "天线",
+    "Laser Antenna": "激光天线",
+    "Beacon": "信标",
+    "Ore Detector": "矿石探测器",
+    "Camera": "摄像头",
+    "Remote Control": "远程控制",
+    "Cockpit": "驾驶舱",
+    "Control Seat": "控制座椅",
+    "Passenger Seat": "乘客座椅",
+    "Interior Light": "室内灯",
+    "Spotlight": "聚光灯",
+    "Door": "门",
+    "Sliding Door": "滑动门",
+    "Airtight Hangar Door": "气密机库门",
+    "Parachute Hatch": "降落伞舱门",
+    "Gatling Turret": "加特林炮塔",
+    "Missile Turret": "导弹炮塔",
+    "Interior Turret": "室内炮塔",
+    "Rocket Launcher": "火箭发射器",
+    "Gatling Gun": "加特林机枪",
+    "Warhead": "弹头",
+    "Decoy": "诱饵",
+    "Upgrade Module": "升级模块",
+    "Yield Module": "产量模块",
+    "Speed Module": "速度模块",
+    "Power Efficiency Module": "能效模块",
+    "Safe Zone": "安全区",
+    "Store": "商店",
+    "Contract": "合同",
+    "Vending Machine": "自动售货机",
+}
 ADD_LANGUAGE_TAG = False
+BATCH_SIZE = 40  # 每次请求打包的条目数上限，可用 --batch-size 覆盖
+MAX_INPUT_TOKENS = 4000  # 每次请求待翻译内容的 token 预算，可用 --max-input-tokens 覆盖
+MAX_OUTPUT_TOKENS = 6000  # 每次请求译文的 token 预算，可用 --max-output-tokens 覆盖
+HINT_TOKEN_BUDGET = 600  # 从输入预算中为术语和参考译文预留的 token 数，最多占输入预算的四分之一
+OUTPUT_TOKEN_RATIO = 1.5  # 译文 token 数相对原文的估计倍数
+ENTRY_TOKEN_OVERHEAD = 6  # JSON 编号、引号等每条额外开销
+
+PROMPT_RULES = (
+    "你是一个专业的技术文档翻译引擎，请严格遵循以下规则：\n"
+    "将所有语言都汉化为中文\n"
+    "遇到类似层级结构名称（如'项目-资源-石头'），乱码，符号时不要进行翻译，原文输出\n"
+    "不要添加任何说明符号\n"
+    "形如 {N1} 的占位符原样保留在译文中的对应位置\n"
+)
+SOURCE_MARKER = "待翻译内容：\n"
+SINGLE_PROMPT = PROMPT_RULES
+HINT_PROMPT = "以下是相似原文的已有译文，请保持术语和风格一致：\n"
+GLOSSARY_PROMPT = "以下术语必须按术语表翻译：\n"
+BATCH_PROMPT = PROMPT_RULES + (
+    "待翻译内容是一个 JSON 对象，键为编号，值为待翻译文本\n"
+    "只输出一个 JSON 对象，键与输入的编号一一对应，值为对应的译文，不要输出其他内容\n"
+)
 
 # 从modid.txt文件的第一行读取MOD_FOLDER的路径
 MOD_ID_LIST_FILE = os.path.join(script_dir, "modid.txt")
@@ -50,74 +275,784 @@ with open(MOD_ID_LIST_FILE, "r", encoding="utf-8") as f:
     MOD_FOLDER = f.readline().strip()
 
 api_call_counter = 0
+glossary = None  # 由 main 按 load_glossary 载入
 translation_stats = {"total": 0, "success": 0, "failed": 0}
+skip_stats = {"rules": 0, "unchanged": 0}  # 本地判定无需翻译而省下的条目数
+encoding_stats = {"bom": 0, "declaration": 0, "utf8": 0, "chardet": 0, "memo": 0}
+encoding_memo = {}  # 文件内容哈希 -> 编码，多个 mod 带有相同文件时只检测一次
+parse_stats = {"files": 0, "bytes": 0, "seconds": 0.0, "fallback": 0, "read_seconds": 0.0, "detect_seconds": 0.0, "mapped": 0}
+XML_ENTITIES = {"&quot;": '"', "&apos;": "'"}
+
+HORIZONTAL_SPACE_PATTERN = re.compile(r'[^\S\n]+')
+
+def normalize_text(text):
+    """规范化原文：Unicode NFC、统一换行符、合并行内空白、去掉首尾空白"""
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    lines = [HORIZONTAL_SPACE_PATTERN.sub(" ", line).strip() for line in text.split("\n")]
+    return "\n".join(lines).strip()
+
+def cache_key(tag, text):
+    if FOLD_TAGS:
+        tag = TAG_FOLDING.get(tag, tag)
+    return f"{tag}:{normalize_text(text)}"
+
+def restore_format(source, translated):
+    """按节点在源文件中的原始文本恢复首尾空白和换行符风格
+
+    source 取自源文件字节，未去除首尾空白，CRLF 也未被 XML 解析器换成 LF。
+    """
+    translated = translated.replace("\r\n", "\n")
+    if "\r\n" in source:
+        translated = translated.replace("\n", "\r\n")
+    leading = source[:len(source) - len(source.lstrip())]
+    trailing = source[len(source.rstrip()):]
+    return f"{leading}{translated}{trailing}"
+
+TEMPLATE_PATTERN = re.compile(r'''
+    \d+(?:\.\d+)?(?:\s*[x×]\s*\d+(?:\.\d+)?)+    # 尺寸，如 3x3x3
+    |\b(?:Mk|MK|Mark|Ver|v|V)\.?\s?\d+(?:\.\d+)*\b  # 版本后缀，如 Mk2、v1.2
+    |\d+(?:[.,]\d+)*                              # 普通数字
+''', re.VERBOSE)
+PLACEHOLDER_PATTERN = re.compile(r'\{N(\d+)\}')
+
+def make_template(text):
+    """把数字、尺寸、版本号替换为 {N1}、{N2}…，返回 (模板, 原值列表)
+
+    没有可替换内容、原文本身含占位符或替换后不剩文字时返回空列表。
+    """
+    if PLACEHOLDER_PATTERN.search(text):
+        return text, []
+    values = []
+
+    def mask(match):
+        values.append(match.group(0))
+        return f"{{N{len(values)}}}"
+
+    template = TEMPLATE_PATTERN.sub(mask, text)
+    if not values or not re.search(r'[^\W\d_]', PLACEHOLDER_PATTERN.sub("", template)):
+        return text, []
+    return template, values
+
+def fill_template(translated, values):
+    return PLACEHOLDER_PATTERN.sub(lambda m: values[int(m.group(1)) - 1], translated)
+
+def placeholders_intact(source, translated):
+    """译文中的占位符必须与原文一一对应"""
+    return sorted(PLACEHOLDER_PATTERN.findall(source)) == sorted(PLACEHOLDER_PATTERN.findall(translated))
+
+class APIError(Exception):
+    """HTTP 层面的错误，保留状态码和服务端建议的重试等待时间"""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+
+def parse_retry_after(value):
+    """Retry-After 可以是秒数，也可以是 HTTP 日期"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def retry_delay(error, attempt):
+    """限流错误由限速器负责等待，其余错误指数退避并加入抖动"""
+    if isinstance(error, APIError) and error.status == 429:
+        return 0
+    return min(REQUEST_DELAY * 2 ** attempt, MAX_RETRY_DELAY) * random.uniform(0.5, 1.0)
+
+class KeyRateLimiter:
+    """单个密钥的令牌桶限速器，同时限制每分钟请求数和每分钟 token 数
+
+    收到 429 时速率减半并在 Retry-After 期间暂停发送，之后每次成功逐步
+    恢复到配置的配额（加性增、乘性减），使吞吐贴近密钥的真实配额。
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self.scale = 1.0
+        self.request_tokens = self.request_capacity()
+        self.token_tokens = self.token_capacity()
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def request_capacity(self):
+        return max(1.0, self.rpm * self.scale / 60 * RATE_BURST_SECONDS)
+
+    def token_capacity(self):
+        return max(1.0, self.tpm * self.scale / 60 * RATE_BURST_SECONDS)
+
+    def refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        self.request_tokens = min(self.request_capacity(), self.request_tokens + elapsed * self.rpm * self.scale / 60)
+        self.token_tokens = min(self.token_capacity(), self.token_tokens + elapsed * self.tpm * self.scale / 60)
+
+    def reserve(self, tokens):
+        """预占一次请求的额度，返回发送前需要等待的秒数"""
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            # 单次请求超过桶容量时按桶容量计，避免永远等不到
+            tokens = min(tokens, self.token_capacity())
+            self.request_tokens -= 1
+            self.token_tokens -= tokens
+            wait = max(
+                self.blocked_until - now,
+                -self.request_tokens * 60 / (self.rpm * self.scale),
+                -self.token_tokens * 60 / (self.tpm * self.scale),
+                0.0
+            )
+            return wait
+
+    async def wait_ready(self):
+        """等待 Retry-After 暂停期结束，暂停期间不领取新批次"""
+        wait = self.blocked_until - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def acquire(self, tokens):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def adjust(self, tokens):
+        """用响应里的实际用量修正预估（正数表示多用了）"""
+        with self.lock:
+            self.token_tokens -= tokens
+
+    def on_success(self):
+        with self.lock:
+            self.scale = min(1.0, self.scale + RATE_RECOVERY_STEP)
+
+    def on_throttled(self, retry_after):
+        with self.lock:
+            self.throttled += 1
+            self.scale = max(MIN_RATE_SCALE, self.scale / 2)
+            pause = retry_after if retry_after is not None else REQUEST_DELAY
+            self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+            # 已经预占的额度按新的速率重新计算
+            self.request_tokens = min(self.request_tokens, 0.0)
+
+def replace_atomically(path, write):
+    """write(f) 写入同目录下的唯一临时文件，fsync 后原子替换 path；同时写入的多个调用不会共用临时文件"""
+    fd, temp_path = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.", suffix=".tmp",
+                                     dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+class JsonCacheStore:
+    """translation_cache.json 存储，每次写入整体快照：先写临时文件再原子替换"""
+
+    snapshot = True
+
+    def __init__(self, path):
+        self.path = path
+
+    def items(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f).items()
+
+    def write(self, items, entries):
+        replace_atomically(self.path, lambda f: json.dump(entries, f, ensure_ascii=False, indent=2))
+
+    def close(self):
+        pass
+
+class SqliteTranslationCache:
+    """基于 sqlite3（WAL 模式）的翻译缓存
+
+    启动时由 TranslationCache 整体载入，之后每批译文一个事务增量写入，多个线程共用时由锁串行化；
+    首次打开时把旧的 translation_cache.json 一次性迁移进来。
+    """
+
+    snapshot = False
+
+    def __init__(self, path, json_path=CACHE_FILE):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.migrate_json(json_path)
+
+    def migrate_json(self, json_path):
+        with self.lock:
+            migrated = self.conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+        if migrated or not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"旧缓存读取失败，跳过迁移: {e}")
+            return
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO translations (key, value) VALUES (?, ?)", data.items())
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                              (time.strftime("%Y-%m-%d %H:%M:%S"),))
+        print(f"已将 {len(data)} 条旧缓存从 {json_path} 迁移到 {self.path_of()}")
+
+    def path_of(self):
+        return self.conn.execute("PRAGMA database_list").fetchone()[2]
+
+    def update(self, items):
+        """在一个事务里写入多条译文"""
+        if not items:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO translations (key, value) VALUES (?, ?)", items.items())
+
+    def items(self):
+        with self.lock:
+            return self.conn.execute("SELECT key, value FROM translations").fetchall()
+
+    def write(self, items, entries):
+        self.update(items)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class TranslationCache:
+    """所有密钥共用的内存缓存，启动时从持久化存储一次性载入
+
+    一个密钥刚翻译完的条目，其他密钥立即可以命中。新条目先进入缓冲区，
+    由后台线程按时间间隔或条目数阈值批量写入存储，翻译路径从不等待磁盘；
+    close() 会写完缓冲区中剩余的条目。
+    """
+
+    def __init__(self, store, flush_interval=CACHE_FLUSH_INTERVAL, flush_size=CACHE_FLUSH_SIZE):
+        self.store = store
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.entries = dict(store.items())
+        self.memory = None  # 可选的 TranslationMemory，随缓存写入更新
+        self.journal = None  # 可选的 RunJournal，新译文同时追加到日志
+        self.pending = {}
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.stats = {"hits": 0, "misses": 0, "flushes": 0}
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.flusher = threading.Thread(target=self.flush_loop, name="cache-flusher", daemon=True)
+        self.flusher.start()
+
+    def get(self, key, default=None):
+        value = self.entries.get(key)
+        return value if value is not None else default
+
+    def count_lookup(self, hit):
+        """按条目计数：一个条目无论探查了负缓存、规范化键、旧键还是模板键，只记一次命中或未命中"""
+        with self.lock:
+            self.stats["hits" if hit else "misses"] += 1
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, items):
+        with self.lock:
+            new_keys = [key for key in items if key not in self.entries]
+            self.entries.update(items)
+            self.pending.update(items)
+            full = len(self.pending) >= self.flush_size
+        if self.memory is not None and new_keys:
+            self.memory.add(new_keys)
+        if self.journal is not None:
+            self.journal.add_entries(items)
+        if full:
+            self.wakeup.set()
+
+    def flush_loop(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        # 后台线程与主线程可能同时刷新，flush_lock 保证写入按取出缓冲区的顺序逐个进行，
+        # 较旧的快照不会覆盖较新的快照
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return
+                items, self.pending = self.pending, {}
+                entries = dict(self.entries) if self.store.snapshot else None
+            try:
+                self.store.write(items, entries)
+                self.stats["flushes"] += 1
+            except Exception as e:
+                print(f"缓存保存失败: {e}")
+                with self.lock:
+                    # 放回缓冲区等待下次刷新，期间的新值优先
+                    self.pending = {**items, **self.pending}
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.wakeup.set()
+        self.flusher.join()
+        self.flush()
+        self.store.close()
+
+    def summary(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        rate = self.stats["hits"] / lookups if lookups else 0
+        return f"缓存: {len(self.entries)} 条, 查询 {lookups} 次, 命中率 {rate:.1%}, 写入磁盘 {self.stats['flushes']} 次\n"
+
+class TranslationMemory:
+    """模糊翻译记忆：对已缓存的原文建立字符三元组倒排索引
+
+    查询时按前缀过滤只扫描最稀有的三元组倒排表，再对少量候选计算 Dice
+    相似度。相似度达到 TM_REUSE_THRESHOLD 且标签相同时直接复用译文，
+    达到 TM_HINT_THRESHOLD 时作为参考译文放进提示词。索引由后台线程从缓存
+    建立，建好之前查询直接返回空结果，之后随缓存写入增量更新。
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.keys = []  # 条目下标 -> 缓存键
+        self.sizes = array("I")  # 条目下标 -> 三元组个数，用于按长度排除候选
+        self.postings = {}  # 三元组哈希 -> array('I') 条目下标
+        self.backlog = []  # 索引建立期间新写入的缓存键
+        self.built = False
+        self.lock = threading.Lock()
+        self.stats = {"queries": 0, "seconds": 0.0, "reused": 0, "hinted": 0, "build_seconds": 0.0}
+        threading.Thread(target=self.build, name="translation-memory", daemon=True).start()
+
+    @staticmethod
+    def grams(text):
+        text = f"  {text.lower()} "
+        return {hash(text[i:i + 3]) for i in range(len(text) - 2)}
+
+    def build(self):
+        start = time.perf_counter()
+        for key in list(self.cache.entries):
+            self.index(key)
+        with self.lock:
+            for key in self.backlog:
+                self.index(key)
+            self.backlog = []
+            self.built = True
+        self.stats["build_seconds"] = time.perf_counter() - start
+
+    def index(self, key):
+        if key.startswith("!"):
+            return
+        text = key.split(":", 1)[1]
+        if len(text) > TM_MAX_CHARS or PLACEHOLDER_PATTERN.search(text):
+            return
+        position = len(self.keys)
+        self.keys.append(key)
+        grams = self.grams(text)
+        self.sizes.append(len(grams))
+        postings = self.postings
+        for gram in grams:
+            posting = postings.get(gram)
+            if posting is None:
+                postings[gram] = array("I", (position,))
+            else:
+                posting.append(position)
+
+    def add(self, keys):
+        with self.lock:
+            if self.built:
+                for key in keys:
+                    self.index(key)
+            else:
+                self.backlog.extend(keys)
+
+    def search(self, text, threshold):
+        """返回相似度不低于 threshold 的 [(相似度, 缓存键)]，按相似度降序"""
+        if not self.built:
+            return []
+        start = time.perf_counter()
+        query = self.grams(text)
+        with self.lock:
+            # 相似度达标的候选至少与查询共享 min_overlap 个三元组，
+            # 因此必然出现在最稀有的 len(query) - min_overlap + 1 个倒排表中
+            min_overlap = math.ceil(threshold * len(query) / (2 - threshold))
+            # 三元组个数相差过大的条目相似度不可能达标，不必计算
+            min_size = threshold * len(query) / (2 - threshold)
+            max_size = (2 - threshold) * len(query) / threshold
+            sizes = self.sizes
+            lists = sorted((self.postings.get(gram, ()) for gram in query), key=len)
+            counts = Counter()
+            scanned = 0
+            for posting in lists[:len(query) - min_overlap + 1]:
+                scanned += len(posting)
+                if len(posting) > TM_MAX_POSTING or scanned > TM_MAX_SCAN:
+                    break
+                counts.update(posting)
+            ranked = counts.most_common(TM_MAX_CANDIDATES * 3)
+            candidates = [self.keys[i] for i, _ in ranked if min_size <= sizes[i] <= max_size][:TM_MAX_CANDIDATES]
+
+        matches = []
+        for key in candidates:
+            other = self.grams(key.split(":", 1)[1])
+            score = 2 * len(query & other) / (len(query) + len(other))
+            if score >= threshold:
+                matches.append((score, key))
+        matches.sort(reverse=True)
+        self.stats["queries"] += 1
+        self.stats["seconds"] += time.perf_counter() - start
+        return matches
+
+    def reuse(self, tag, text):
+        """标签相同且几乎一致的已有译文，没有则返回 None"""
+        prefix = cache_key(tag, "")
+        for score, key in self.search(text, TM_REUSE_THRESHOLD):
+            if key.startswith(prefix):
+                translated = self.cache.get(key)
+                if translated is not None:
+                    self.stats["reused"] += 1
+                    return translated
+        return None
+
+    def reuse_many(self, items):
+        """items 为 {缓存键: (标签, 原文)}，返回可直接复用的 {缓存键: 译文}"""
+        reused = {}
+        for key, (tag, text) in items.items():
+            translated = self.reuse(tag, text)
+            if translated is not None:
+                reused[key] = translated
+        return reused
+
+    def hints(self, texts):
+        """为一批原文找参考译文，返回 [(原文, 译文)]，最多 TM_MAX_HINTS 条"""
+        sources = set(texts)
+        found = {}
+        for text in texts:
+            for score, key in self.search(text, TM_HINT_THRESHOLD)[:2]:
+                source = key.split(":", 1)[1]
+                if source not in sources and source not in found:
+                    translated = self.cache.get(key)
+                    if translated is not None:
+                        found[source] = translated
+            if len(found) >= TM_MAX_HINTS:
+                break
+        self.stats["hinted"] += len(found)
+        return list(found.items())[:TM_MAX_HINTS]
+
+    def summary(self):
+        average = self.stats["seconds"] / self.stats["queries"] * 1000 if self.stats["queries"] else 0
+        return (f"翻译记忆: 索引 {len(self.keys)} 条 (建立 {self.stats['build_seconds']:.2f} 秒), "
+                f"查询 {self.stats['queries']} 次 (平均 {average:.3f} 毫秒), "
+                f"直接复用 {self.stats['reused']} 条, 参考译文 {self.stats['hinted']} 条\n")
+
+class Glossary:
+    """术语表：整条原文命中时本地直接给出译文，术语出现在原文中时注入提示词
+
+    术语按大小写精确匹配，display、store 这类小写动词不会被当成 Display、Store；
+    单个单词的术语出现在句首时大写不能说明是专有名词，也不注入。
+    """
+
+    def __init__(self, terms):
+        self.terms = {}  # 术语 -> 译文
+        for term, translated in terms.items():
+            term = normalize_text(term)
+            if term and translated:
+                self.terms[term] = translated
+        alternatives = "|".join(re.escape(term) for term in sorted(self.terms, key=len, reverse=True))
+        self.pattern = re.compile(rf"\b(?:{alternatives})\b") if self.terms else None
+        self.stats = {"hits": 0, "injected": 0}
+
+    def match(self, text):
+        """整条原文即术语时返回术语本身，否则返回 None"""
+        text = normalize_text(text)
+        return text if text in self.terms else None
+
+    def lookup(self, text):
+        term = self.match(text)
+        if term is None:
+            return None
+        self.stats["hits"] += 1
+        return self.terms[term]
+
+    def relevant(self, texts):
+        """返回出现在这批原文中的 [(术语, 译文)]"""
+        if self.pattern is None:
+            return []
+        found = {}
+        for text in texts:
+            for match in self.pattern.finditer(text):
+                term = match.group(0)
+                before = text[:match.start()].rstrip()
+                if " " not in term and (not before or before[-1] in ".!?:;"):
+                    continue
+                found.setdefault(term, self.terms[term])
+        self.stats["injected"] += len(found)
+        return list(found.items())
+
+    def summary(self):
+        return f"术语表: {len(self.terms)} 条, 本地命中 {self.stats['hits']} 条, 提示词注入术语 {self.stats['injected']} 次\n"
+
+def load_glossary(path):
+    """默认术语表叠加用户术语表（JSON 对象，原文 -> 译文），用户条目优先"""
+    terms = dict(DEFAULT_GLOSSARY)
+    if path and os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                terms.update(json.load(f))
+        except Exception as e:
+            print(f"术语表读取失败: {e}")
+    return Glossary(terms)
+
+class SingleFlight:
+    """同一缓存键同一时刻只发出一次请求，后来者等待先行者的 future
+
+    只在引擎的事件循环内使用，各文件线程提交的协程都汇聚在这里，
+    因此整个进程内同一个 tag:text 最多只有一个在途请求。
+    """
+
+    def __init__(self):
+        self.inflight = {}
+        self.stats = {"leaders": 0, "joined": 0}
+
+    def claim(self, key):
+        """返回 (future, 是否由调用者负责请求)"""
+        future = self.inflight.get(key)
+        if future is not None:
+            self.stats["joined"] += 1
+            return future, False
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        self.stats["leaders"] += 1
+        return future, True
+
+    def resolve(self, key, translated):
+        """交付结果，translated 为 None 表示请求失败"""
+        future = self.inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(translated)
+
+    def summary(self):
+        return f"在途去重: 发起请求 {self.stats['leaders']} 条, 合并重复请求 {self.stats['joined']} 条\n"
+
+class AsyncTranslationEngine:
+    """在后台线程运行一个 asyncio 事件循环，所有密钥的请求都在这个循环里并发"""
+
+    def __init__(self):
+        self.single_flight = SingleFlight()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="translation-engine", daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        """从任意线程提交协程，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        return self.submit(coro).result()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
 
 class AlibabaBatchTranslator:
-    def __init__(self, api_key, api_url):
+    def __init__(self, api_key, api_url, engine, cache, concurrency=KEY_CONCURRENCY,
+                 requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
         self.api_key = api_key
         self.url = api_url
-        self.cache = self.load_cache()
+        self.engine = engine
+        self.concurrency = concurrency
+        self.limiter = KeyRateLimiter(requests_per_minute, tokens_per_minute)
+        # 所有密钥共用同一个缓存对象
+        self.cache = cache
+        self.session = self.create_session(concurrency)
+        # 每个密钥最多同时在途 concurrency 个请求
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.aio_session = None
+        self.aio_stats = {"requests": 0, "handshakes": 0}
+        # 未安装 aiohttp 时用这个线程池发送阻塞请求
+        self.executor = None if aiohttp else ThreadPoolExecutor(max_workers=concurrency)
 
-    def load_cache(self):
-        if os.path.exists(CACHE_FILE):
-            with open(CACHE_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        return {}
+    def create_session(self, concurrency):
+        """每个密钥独占一个长连接池，跨文件、跨 MOD 复用 TCP/TLS 连接"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "Connection": "keep-alive"
+        })
+        return session
 
-    def save_cache(self):
-        try:
-            with open(CACHE_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.cache, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"缓存保存失败: {e}")
+    def create_aio_session(self):
+        """aiohttp 会话必须在事件循环内创建，连接池大小与信号量一致"""
+        stats = self.aio_stats
 
-    def translate_text(self, tag, text):
-        global api_call_counter
-        api_call_counter += 1
-        cache_key = f"{tag}:{text}"
+        async def on_request_start(session, context, params):
+            stats["requests"] += 1
 
-        if cache_key in self.cache:
-            return self.cache[cache_key]
+        async def on_connection_create_end(session, context, params):
+            stats["handshakes"] += 1
 
-        payload = {
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
+            timeout=aiohttp.ClientTimeout(total=TIMEOUT_SECONDS),
+            trace_configs=[trace]
+        )
+
+    def connection_stats(self):
+        """返回 (请求数, 新建连接数)，新建连接数即 TCP/TLS 握手次数"""
+        requests_sent = self.aio_stats["requests"]
+        handshakes = self.aio_stats["handshakes"]
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                requests_sent += pool.num_requests
+                handshakes += pool.num_connections
+        return requests_sent, handshakes
+
+    async def aclose(self):
+        if self.aio_session is not None:
+            await self.aio_session.close()
+
+    def close(self):
+        self.engine.run(self.aclose())
+        self.session.close()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def build_payload(self, prompt):
+        return {
             "model": "qwen-max-latest",
-            "input": {
-                "prompt": (
-                    "你是一个专业的技术文档翻译引擎，请严格遵循以下规则：\n"
-                    "将所有语言都汉化为中文\n"
-                    "遇到类似层级结构名称（如'项目-资源-石头'），乱码，符号时不要进行翻译，原文输出\n"
-                    "不要添加任何说明符号\n"
-                    "待翻译内容：\n" + text
-                )
-            }
+            "input": {"prompt": prompt}
         }
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+    def extract_text(self, result):
+        if "output" in result and "text" in result["output"]:
+            return result["output"]["text"].strip()
+        raise Exception(f"API返回异常: {result}")
 
-        for attempt in range(MAX_RETRIES):
-            try:
-                response = requests.post(self.url, json=payload, headers=headers, timeout=TIMEOUT_SECONDS)
-                response.raise_for_status()
-                result = response.json()
-
-                if "output" in result and "text" in result["output"]:
-                    translated = self.clean_translation(result["output"]["text"].strip())
-                    # 检查翻译结果是否为空
-                    if not translated:
-                        print(f"警告: 翻译结果为空 (Tag: {tag}, Original: {text})")
-                        raise Exception("API 返回的翻译结果为空")
-                    
-                    self.cache[cache_key] = translated
-                    self.save_cache()
-                    return translated
-                raise Exception(f"API返回异常: {result}")
-            except Exception as e:
-                print(f"翻译尝试 {attempt + 1} 失败: {e}")
-                time.sleep(REQUEST_DELAY)
-        raise Exception("达到最大重试次数")
+    def request_json(self, prompt):
+        """发送一次阻塞请求并返回 (状态码, 响应头, 响应体)"""
+        response = self.session.post(self.url, json=self.build_payload(prompt), timeout=TIMEOUT_SECONDS)
+        return response.status_code, response.headers, response.text
+
+    async def arequest_json(self, prompt):
+        if aiohttp is None:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self.request_json, prompt)
+        if self.aio_session is None:
+            self.aio_session = self.create_aio_session()
+        async with self.aio_session.post(self.url, json=self.build_payload(prompt)) as response:
+            return response.status, response.headers, await response.text()
+
+    async def arequest_text(self, prompt):
+        """在事件循环内发送一次请求，受该密钥的并发信号量和限速器限制"""
+        estimated = estimate_tokens(prompt) + int(estimate_tokens(prompt) * OUTPUT_TOKEN_RATIO)
+        async with self.semaphore:
+            await self.limiter.acquire(estimated)
+            status, headers, body = await self.arequest_json(prompt)
+        if status == 429:
+            retry_after = parse_retry_after(headers.get("Retry-After"))
+            self.limiter.on_throttled(retry_after)
+            raise APIError(status, body[:200], retry_after)
+        if status >= 400:
+            raise APIError(status, body[:200])
+        self.limiter.on_success()
+        result = json.loads(body)
+        usage = result.get("usage") or {}
+        if "input_tokens" in usage and "output_tokens" in usage:
+            self.limiter.adjust(usage["input_tokens"] + usage["output_tokens"] - estimated)
+        return self.extract_text(result)
+
+    async def request_translations(self, items):
+        """对 items（[(tag, text), ...]）发送一次请求，返回 {下标: 译文}
+
+        只包含校验通过的条目，这些条目同时写入缓存；请求本身失败时抛出异常。
+        """
+        global api_call_counter
+        api_call_counter += 1
+        sections = []
+        if glossary is not None:
+            # 只注入本批原文中出现的术语；预算不足时术语优先于参考译文
+            sections.append((GLOSSARY_PROMPT, glossary.relevant([text for _, text in items])))
+        if self.cache.memory is not None:
+            # 模糊检索放到线程池中，不占用所有密钥共用的事件循环
+            found = await asyncio.get_running_loop().run_in_executor(
+                None, self.cache.memory.hints, [text for _, text in items])
+            sections.append((HINT_PROMPT, found))
+        hints = build_hints(sections)
+        if len(items) == 1:
+            tag, text = items[0]
+            translated = self.clean_translation(await self.arequest_text(SINGLE_PROMPT + hints + SOURCE_MARKER + text))
+            # 检查翻译结果是否为空
+            if not translated:
+                print(f"警告: 翻译结果为空 (Tag: {tag}, Original: {text})")
+                raise Exception("API 返回的翻译结果为空")
+            results = {0: translated}
+        else:
+            sources = {str(i + 1): text for i, (_, text) in enumerate(items)}
+            reply = await self.arequest_text(
+                BATCH_PROMPT + hints + SOURCE_MARKER + json.dumps(sources, ensure_ascii=False, indent=0))
+            results = {int(k) - 1: v for k, v in self.parse_batch_reply(reply, sources).items()}
+
+        # 模板的占位符丢失或被改动时视为缺失，由调用方重试
+        for i in [i for i, translated in results.items() if not placeholders_intact(items[i][1], translated)]:
+            print(f"警告: 译文占位符不匹配 (Original: {items[i][1]}, Translated: {results.pop(i)})")
+        updates = {cache_key(*items[i]): translated for i, translated in results.items()}
+        # 原样返回的原文记入负缓存，以后任何标签遇到都在本地跳过
+        updates.update({keep_key(items[i][1]): items[i][1] for i, translated in results.items()
+                        if normalize_text(translated) == normalize_text(items[i][1])})
+        self.cache.update(updates)
+        return results
+
+    def parse_batch_reply(self, reply, sources):
+        """解析批量回复的 JSON 对象，只保留编号存在且译文非空的条目"""
+        reply = re.sub(r"^```(?:json)?\s*|\s*```$", "", reply.strip())
+        start, end = reply.find("{"), reply.rfind("}")
+        if start == -1 or end <= start:
+            raise Exception(f"批量结果不是 JSON 对象: {reply[:200]}")
+        data = json.loads(reply[start:end + 1])
+        if not isinstance(data, dict):
+            raise Exception(f"批量结果不是 JSON 对象: {reply[:200]}")
+
+        translated = {}
+        for key in sources:
+            value = data.get(key)
+            if not isinstance(value, str):
+                continue
+            value = self.clean_translation(value)
+            if value:
+                translated[key] = value
+        return translated
 
     def clean_translation(self, text):
         patterns = [
@@ -131,107 +1066,910 @@ class AlibabaBatchTranslator:
             text = re.sub(pattern, "", text, flags=re.IGNORECASE)
         return text.strip()
 
-def detect_encoding(file_path):
+BYTE_ORDER_MARKS = [  # UTF-32 LE 的 BOM 以 UTF-16 LE 的 BOM 开头，需先判断
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+XML_DECLARATION_PATTERN = re.compile(rb'''^\s*<\?xml[^>]*?\sencoding\s*=\s*["']([A-Za-z0-9._-]+)["']''')
+
+def iter_chunks(raw, start=0, end=None, chunk_size=PARSE_CHUNK_SIZE):
+    """按块产出缓冲区 [start, end) 的视图
+
+    对内存映射，每块用完后即释放其驻留页（页缓存仍保留），扫描大文件时峰值内存不随文件大小增长。
+    """
+    end = len(raw) if end is None else end
+    release = isinstance(raw, mmap.mmap) and hasattr(raw, "madvise")
+    with memoryview(raw) as view:  # 及时释放导出的缓冲区，内存映射才能关闭
+        for offset in range(start, end, chunk_size):
+            stop = min(offset + chunk_size, end)
+            yield view[offset:stop]
+            if release:
+                page_start = offset - offset % mmap.PAGESIZE
+                raw.madvise(mmap.MADV_DONTNEED, page_start, stop - page_start)
+
+def decodes_strictly(raw, encoding):
+    """按块严格解码整个缓冲区，不生成完整的字符串"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    try:
+        for chunk in iter_chunks(raw):
+            decoder.decode(chunk)
+        decoder.decode(b"", final=True)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+def sniff_encoding(raw):
+    """依次尝试 BOM、XML 声明、严格 UTF-8 解码，都不成立时才用 chardet，返回 (编码, 判定方式)"""
+    for bom, encoding in BYTE_ORDER_MARKS:
+        if raw[:len(bom)] == bom:
+            return encoding, "bom"
+
+    match = XML_DECLARATION_PATTERN.match(raw[:200])
+    if match:
+        declared = match.group(1).decode("ascii").lower()
+        try:
+            declared = codecs.lookup(declared).name
+        except LookupError:
+            declared = None
+        # 声明能按 ASCII 读出说明不可能是 UTF-16/32；声明为 UTF-8 的仍需严格解码验证，部分 mod 声明与实际编码不符
+        if declared and declared != "utf-8" and not declared.startswith(("utf-16", "utf-32")):
+            return declared, "declaration"
+
+    if decodes_strictly(raw, "utf-8"):
+        return "utf-8", "utf8"
+
+    detected = chardet.detect(raw[:4096])
+    encoding = detected['encoding'] or 'utf-8'
+    confidence = detected.get('confidence', 0)
+
+    if confidence < 0.7:
+        encoding = 'utf-8'
+
+    return encoding, "chardet"
+
+def detect_encoding(raw):
     try:
-        with open(file_path, 'rb') as f:
-            raw = f.read(4096)
-        detected = chardet.detect(raw)
-        encoding = detected['encoding'] or 'utf-8'
-        confidence = detected.get('confidence', 0)
-        
-        if confidence < 0.7:
-            encoding = 'utf-8'
-        
+        encoding, method = sniff_encoding(raw)
+        encoding_stats[method] += 1
         return encoding
     except Exception as e:
         print(f"检测编码失败: {e}, 默认使用 utf-8")
         return 'utf-8'
 
+def encoding_summary():
+    return (f"编码检测: BOM {encoding_stats['bom']} 个, XML 声明 {encoding_stats['declaration']} 个, "
+            f"严格 UTF-8 {encoding_stats['utf8']} 个, chardet {encoding_stats['chardet']} 个, "
+            f"按文件哈希复用 {encoding_stats['memo']} 个, 耗时 {parse_stats['detect_seconds']:.3f} 秒\n")
+
+class LoadedDocument:
+    """单个文件在一次运行中的内容：原始字节只读取一次，编码在首次用到时检测一次，备份、解析和写回共用
+
+    超过 MMAP_THRESHOLD 的文件以只读内存映射代替读入，raw 为 mmap 对象，用完需 close。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        start = time.perf_counter()
+        if os.path.getsize(path) >= MMAP_THRESHOLD:
+            self._file = open(path, "rb")
+            self.raw = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(self.raw, "madvise"):
+                self.raw.madvise(mmap.MADV_SEQUENTIAL)
+            parse_stats["mapped"] += 1
+        else:
+            with open(path, "rb") as f:
+                self.raw = f.read()
+        parse_stats["read_seconds"] += time.perf_counter() - start
+        self._encoding = None
+        self._digest = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self.raw.close()
+            self._file.close()
+            self._file = None
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            digest = hashlib.sha256()
+            for chunk in iter_chunks(self.raw):
+                digest.update(chunk)
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    @property
+    def encoding(self):
+        if self._encoding is None:
+            start = time.perf_counter()
+            encoding = encoding_memo.get(self.digest)
+            if encoding is None:
+                encoding = encoding_memo[self.digest] = detect_encoding(self.raw)
+            else:
+                encoding_stats["memo"] += 1
+            self._encoding = encoding
+            parse_stats["detect_seconds"] += time.perf_counter() - start
+        return self._encoding
+
+
+class BackupStore:
+    """按内容哈希去重的备份仓库
+
+    每个不同的文件内容在 objects 中只存一份，能 reflink 时与源文件共享数据块，对象写入后设为只读；
+    根目录下按 mod 目录结构放置对象的副本（能 reflink 时不复制数据），方便直接查看和编辑；
+    每次运行在 runs 中写一份索引（相对路径 -> 内容哈希），任何一次运行时的原文件都可以用 --restore-backup 恢复。
+    """
+
+    def __init__(self, root=BACKUP_FOLDER):
+        self.root = root
+        self.objects = os.path.join(root, "objects")
+        self.runs = os.path.join(root, "runs")
+        self.lock = threading.Lock()
+        self.index = {}
+        # copied_bytes 为实际写入的数据量；reflink 与内容重复的文件不复制数据，分开统计
+        self.stats = {"stored": 0, "copied_bytes": 0, "reflinked": 0, "reflinked_bytes": 0,
+                      "deduplicated": 0, "deduplicated_bytes": 0}
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest[2:])
+
+    def put(self, document, rel_path):
+        digest = document.digest
+        object_path = self.object_path(digest)
+        if os.path.exists(object_path):
+            with self.lock:
+                self.stats["deduplicated"] += 1
+                self.stats["deduplicated_bytes"] += len(document.raw)
+        else:
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            temp_path = f"{object_path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                reflinked = self.reflink(document.path, f)
+                if not reflinked:
+                    for chunk in iter_chunks(document.raw):
+                        f.write(chunk)
+            os.replace(temp_path, object_path)
+            os.chmod(object_path, 0o444)
+            with self.lock:
+                self.stats["stored"] += 1
+                if reflinked:
+                    self.stats["reflinked"] += 1
+                    self.stats["reflinked_bytes"] += len(document.raw)
+                else:
+                    self.stats["copied_bytes"] += len(document.raw)
+        self.note(rel_path, digest)
+        self.place(object_path, os.path.join(self.root, rel_path))
+
+    @staticmethod
+    def reflink(source_path, target):
+        if fcntl is None:
+            return False
+        try:
+            with open(source_path, "rb") as source:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            return True
+        except OSError:
+            return False
+
+    def place(self, object_path, tree_path):
+        """在目录结构中放置对象的副本，能 reflink 时共享数据块
+
+        不用硬链接：在目录结构中直接编辑文件会改动所有运行索引共用的对象，
+        --restore-backup 恢复出的就不再是原文件。
+        """
+        os.makedirs(os.path.dirname(tree_path), exist_ok=True)
+        temp_path = f"{tree_path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            if not self.reflink(object_path, f):
+                with open(object_path, "rb") as source:
+                    shutil.copyfileobj(source, f)
+        # 替换目录项而不是写入原文件，旧版本留下的硬链接也就此与对象断开
+        os.replace(temp_path, tree_path)
+
+    def note(self, rel_path, digest):
+        """未重新备份的文件（清单判定未变化）也记入本次索引"""
+        if digest and os.path.exists(self.object_path(digest)):
+            with self.lock:
+                self.index[rel_path] = digest
+
+    def save_index(self, name):
+        os.makedirs(self.runs, exist_ok=True)
+        with self.lock:
+            data = json.dumps(self.index, ensure_ascii=False, indent=2)
+        with open(os.path.join(self.runs, f"{name}.json"), "w", encoding="utf-8") as f:
+            f.write(data)
+
+    def list_runs(self):
+        if not os.path.isdir(self.runs):
+            return []
+        return sorted(name[:-len(".json")] for name in os.listdir(self.runs) if name.endswith(".json"))
+
+    def restore(self, name):
+        """把某次运行索引中的文件恢复到 MOD_FOLDER，内容已一致的文件跳过"""
+        runs = self.list_runs()
+        if name == "latest" and runs:
+            name = runs[-1]
+        if name not in runs:
+            print(f"错误: 找不到备份索引 {name}，可用的有: {', '.join(runs) or '无'}")
+            return
+        with open(os.path.join(self.runs, f"{name}.json"), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        restored = 0
+        for rel_path, digest in index.items():
+            target = os.path.join(MOD_FOLDER, rel_path)
+            if os.path.exists(target):
+                with LoadedDocument(target) as document:
+                    if document.digest == digest:
+                        continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temp_path = f"{target}.restore.tmp"
+            shutil.copyfile(self.object_path(digest), temp_path)
+            os.replace(temp_path, target)
+            restored += 1
+        print(f"已从备份 {name} 恢复 {restored} 个文件，{len(index) - restored} 个文件内容未变")
+
+    def summary(self):
+        megabytes = {key: self.stats[key] / (1024 * 1024)
+                     for key in ("copied_bytes", "reflinked_bytes", "deduplicated_bytes")}
+        return (f"备份: 新增对象 {self.stats['stored']} 个, 其中复制写入 {megabytes['copied_bytes']:.2f} MB、"
+                f"reflink {self.stats['reflinked']} 个 ({megabytes['reflinked_bytes']:.2f} MB, 未复制数据); "
+                f"内容重复 {self.stats['deduplicated']} 个 ({megabytes['deduplicated_bytes']:.2f} MB, 未重复存储); "
+                f"本次索引 {len(self.index)} 个文件\n")
 def load_mod_ids(mod_id_list_file):
     with open(mod_id_list_file, "r", encoding="utf-8") as f:
         lines = f.readlines()
         MOD_FOLDER = lines[0].strip()  # 第一行是MOD_FOLDER路径
         return [line.strip() for line in lines[1:] if line.strip()]  # 从第二行开始读取mod_id
 
-def parse_translatable_content(file_path):
-    encoding = detect_encoding(file_path)
-    with open(file_path, "r", encoding=encoding, errors='replace') as f:
-        content = f.read()
+SIMPLE_TAGS = {"displayname", "description", "tooltip"}
 
-    pattern = re.compile(r'''
-        (?P<full_tag>
-            <(?P<tag>data)\s+name="[^"]+"[^>]*>     # data标签开始
-            \s*<value>\s*(?P<value>.*?)\s*</value>  # value内容
-            \s*</data>                              # data标签结束
-        )
-        |
-        <(?P<simple_tag>DisplayName|Description|Tooltip)>
-            \s*(?P<simple_text>.*?)\s*
-        </(?P=simple_tag)>
-    ''', re.DOTALL | re.IGNORECASE | re.VERBOSE)
-
-    matches = []
-    for match in pattern.finditer(content):
-        if match.group('full_tag'):
-            matches.append(('value', match.group('value').strip(), match.group('full_tag')))
-        elif match.group('simple_tag'):
-            matches.append((match.group('simple_tag'), match.group('simple_text').strip(), None))
+def iter_translatable_nodes(raw, chunk_size=PARSE_CHUNK_SIZE):
+    """流式解析 XML，逐个产出 (tag, text, start, end)
+
+    text 为 expat 解码后的文本（实体已还原、CDATA 已展开），start/end 为标签内容在源文件中的字节偏移。
+    按 chunk_size 分块送入解析器，解析器的内存占用与文件大小无关。XML 不合法时抛出 ExpatError。
+    """
+    parser = expat.ParserCreate()  # 不开启 buffer_text，字符数据事件的偏移才是内容起点
+    nodes = []
+    stack = []
+    current = None  # [tag, 内容起始偏移, 文本片段, 是否含子元素, 深度]
+    pending = False  # 刚进入可翻译标签，等待下一个事件确定内容起始偏移
+
+    def mark(*_):
+        nonlocal pending
+        if pending:
+            current[1] = parser.CurrentByteIndex
+            pending = False
+
+    def start_element(name, attrs):
+        nonlocal current, pending
+        mark()
+        if current is not None:
+            current[3] = True  # 可翻译标签内嵌套了子元素，整段跳过
+        else:
+            lower = name.lower()
+            if lower in SIMPLE_TAGS or (lower == "value" and stack and stack[-1].lower() == "data"):
+                current = ["value" if lower == "value" else name, None, [], False, len(stack)]
+                pending = True
+        stack.append(name)
+
+    def end_element(name):
+        nonlocal current
+        mark()
+        stack.pop()
+        if current is not None and len(stack) == current[4]:
+            if not current[3]:
+                nodes.append((current[0], "".join(current[2]), current[1], parser.CurrentByteIndex))
+            current = None
+
+    def character_data(data):
+        mark()
+        if current is not None:
+            current[2].append(data)
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    parser.StartCdataSectionHandler = mark
+    parser.CommentHandler = mark
+    parser.ProcessingInstructionHandler = mark
+
+    for chunk in iter_chunks(raw, chunk_size=chunk_size):
+        parser.Parse(chunk, False)
+        yield from nodes
+        nodes.clear()
+    parser.Parse(b"", True)
+    yield from nodes
+
+FALLBACK_PATTERN = re.compile(rb'''
+    <data\s[^>]*>\s*<value>(?P<value>.*?)</value>
+    |
+    <(?P<simple_tag>DisplayName|Description|Tooltip)>
+        (?P<simple_text>.*?)
+    </(?P=simple_tag)>
+''', re.DOTALL | re.IGNORECASE | re.VERBOSE)
+
+def regex_translatable_nodes(document):
+    """XML 不合法或编码 expat 不支持时的后备解析，产出格式与 iter_translatable_nodes 相同"""
+    encoding = document.encoding
+    for match in FALLBACK_PATTERN.finditer(document.raw):
+        group = "value" if match.group("value") is not None else "simple_text"
+        tag = "value" if group == "value" else match.group("simple_tag").decode("ascii")
+        text = xml_unescape(match.group(group).decode(encoding, errors="replace"), XML_ENTITIES)
+        yield tag, text, match.start(group), match.end(group)
+
+def parse_translatable_content(document):
+    start = time.perf_counter()
+    try:
+        nodes = list(iter_translatable_nodes(document.raw))
+    except (expat.ExpatError, ValueError) as e:
+        print(f"XML 解析失败，改用正则匹配: {document.path} ({e})")
+        parse_stats["fallback"] += 1
+        nodes = list(regex_translatable_nodes(document))
+    parse_stats["files"] += 1
+    parse_stats["bytes"] += len(document.raw)
+    parse_stats["seconds"] += time.perf_counter() - start
 
     filtered = []
-    for tag, text, context in matches:
+    for tag, text, node_start, node_end in nodes:
+        text = text.strip()
         if any(kw in text for kw in SKIP_KEYWORDS) or is_chinese(text) or len(text) < 2:
             continue
-        filtered.append((tag, text, context))
+        if is_untranslatable(text):
+            skip_stats["rules"] += 1
+            continue
+        filtered.append((tag, text, (node_start, node_end)))
     return filtered
 
-def replace_translated_content(file_path, translations, add_language_tag):
-    encoding = detect_encoding(file_path)
-    with open(file_path, "r", encoding=encoding, errors='replace') as f:
-        content = f.read()
+def parse_summary():
+    seconds = parse_stats["seconds"]
+    megabytes = parse_stats["bytes"] / (1024 * 1024)
+    speed = megabytes / seconds if seconds else 0
+    return (f"解析: 文件 {parse_stats['files']} 个, {megabytes:.2f} MB, 耗时 {seconds:.2f} 秒, "
+            f"{speed:.1f} MB/s, 正则后备 {parse_stats['fallback']} 个, 内存映射 {parse_stats['mapped']} 个, "
+            f"读取 {parse_stats['read_seconds']:.2f} 秒\n")
 
-    replacements = []
-    for tag, original, translated, context in translations:
-        try:
-            if tag == 'value' and context:
-                original_text = re.escape(original)
-                new_content = re.sub(r'<value>\s*%s\s*</value>' % original_text, 
-                                   f'<value>{translated}</value>', 
-                                   context, 
-                                   flags=re.DOTALL)
-                replacements.append((re.escape(context), new_content))
-            else:
-                pattern = fr'<{tag}>\s*{re.escape(original)}\s*</{tag}>'
-                replacements.append((pattern, f'<{tag}>{translated}</{tag}>'))
-        except Exception as e:
-            traceback.print_exc()
+def splice_translations(raw, encoding, translations):
+    """按解析时记录的字节区间一次性拼接译文，逐段产出解码后的文本
 
-    for pattern, replacement in replacements:
-        content = re.sub(pattern, replacement, content, flags=re.DOTALL)
+    区间之间的原始字节按源编码分块增量解码，译文转义后放入对应区间；与原文相同的条目保留原始字节。
+    区间内的原始文本只用来恢复首尾空白和换行符风格。
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    position = 0
+    for tag, original, translated, (start, end) in sorted(translations, key=lambda item: item[3][0]):
+        if translated == original or start < position:
+            continue
+        for chunk in iter_chunks(raw, position, start):
+            yield decoder.decode(chunk)
+        source = "".join(decoder.decode(chunk) for chunk in iter_chunks(raw, start, end))
+        yield xml_escape(restore_format(source, translated))
+        position = end
+    for chunk in iter_chunks(raw, position):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
 
+def output_path_for(file_path, add_language_tag):
     rel_path = os.path.relpath(file_path, MOD_FOLDER)
     if add_language_tag and file_path.endswith('.resx'):
         base, ext = os.path.splitext(rel_path)
         rel_path = f"{base}.zh-CN{ext}"
-    
-    output_path = os.path.join(output_folder, rel_path)
+    return os.path.join(output_folder, rel_path)
+
+def replace_translated_content(document, translations, add_language_tag):
+    output_path = output_path_for(document.path, add_language_tag)
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
     with open(output_path, "w", encoding="utf-8", newline='\n') as f:
-        f.write(content)
+        f.writelines(splice_translations(document.raw, document.encoding, translations))
+
+CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
 
 def is_chinese(text):
     return bool(re.search(r'[\u4e00-\u9fff]', text))
 
-def batch_translate(translator, batch):
-    try:
+# 不需要翻译的原文：标识符、颜色、路径、纯格式串等，命中任意一条即在本地跳过
+UNTRANSLATABLE_PATTERNS = [
+    re.compile(r'^#(?:[0-9A-Fa-f]{3,4}|[0-9A-Fa-f]{6}|[0-9A-Fa-f]{8})$'),  # 十六进制颜色
+    re.compile(r'^(?:0x)?(?=[0-9A-Fa-f]*\d)[0-9A-Fa-f]{6,}$'),  # 十六进制数值
+    re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$'),  # GUID
+    re.compile(r'^(?:https?|steam|file)://\S+$', re.IGNORECASE),  # 链接
+    re.compile(r'^[\w.-]*(?:[\\/][\w .-]+)+\.\w{1,5}$|^[\w.-]+\.(?:dds|png|mwm|sbc|resx|xml|wav|xwm|cs)$', re.IGNORECASE),  # 文件路径
+    re.compile(r'^(?:\{\d+(?::[^{}]*)?\}|[\W\d_])+$'),  # 只有格式占位符、数字和符号
+    # 以下几条只认带数字或下划线等的明确标识符；AutoMiner、Self-Repair-Module 这类
+    # 可能是玩家可见名称的照常请求，模型原样返回后由负缓存跳过
+    re.compile(r'^(?=.*[\d_.:])[A-Za-z0-9]+(?:[-_.:][A-Za-z0-9]+){2,}$'),  # 层级结构名称，如 Item_Resource.Stone
+    re.compile(r'^[A-Za-z][A-Za-z0-9]*(?:_[A-Za-z0-9]+)+$'),  # 下划线标识符，如 LargeBlock_Armor
+    re.compile(r'^(?=.*\d)[a-z]+(?:[A-Z][a-z0-9]*)+$'),  # 驼峰标识符，如 largeBlockArmor2
+    re.compile(r'^(?=.*\d)[A-Z][a-z0-9]+(?:[A-Z][a-z0-9]*)+$'),  # 帕斯卡标识符，如 LargeBlockArmor2x
+]
+
+def is_untranslatable(text):
+    return any(pattern.match(text) for pattern in UNTRANSLATABLE_PATTERNS)
+
+def keep_key(text):
+    """负缓存键：模型曾原样返回的原文，与标签无关"""
+    return f"!keep:{normalize_text(text)}"
+
+def is_key_failure(error):
+    """鉴权、限流、服务端错误和网络错误计入密钥健康度，模型输出格式错误不计入"""
+    if isinstance(error, APIError):
+        return error.status in (401, 403, 429) or error.status >= 500
+    network_errors = (asyncio.TimeoutError, OSError, requests.RequestException)
+    if aiohttp is not None:
+        network_errors += (aiohttp.ClientError,)
+    return isinstance(error, network_errors)
+
+class KeyHealth:
+    """单个密钥的熔断器
+
+    连续失败 KEY_MAX_FAILURES 次后熔断，冷却期内不再领取批次；冷却结束进入
+    半开状态，只放行一个探测批次，成功则恢复，失败则以加倍的冷却时间再次熔断。
+    鉴权失败（401/403）的冷却时间更长。
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "正常", "熔断", "半开"
+
+    def __init__(self, name):
+        self.name = name
+        self.state = self.CLOSED
+        self.failures = 0
+        self.cooldown = BREAKER_COOLDOWN
+        self.open_until = 0.0
+        self.probing = False
+        self.transitions = []  # (时间, 原状态, 新状态, 原因)
+
+    def transition(self, state, reason=""):
+        self.transitions.append((time.strftime("%H:%M:%S"), self.state, state, reason))
+        print(f"{self.name}: {self.state} -> {state} {reason}")
+        self.state = state
+
+    def allow(self):
+        """是否允许工作协程领取批次；半开状态下只放行一个探测批次"""
+        if self.state == self.OPEN:
+            if time.monotonic() < self.open_until:
+                return False
+            self.transition(self.HALF_OPEN, "冷却结束，开始探测")
+        if self.state == self.HALF_OPEN:
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def release(self):
+        """探测名额未被使用（没有领到批次）时归还"""
+        self.probing = False
+
+    def retry_in(self):
+        """距离下一次可以发送请求的秒数"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.open_until - time.monotonic())
+
+    def record_success(self):
+        self.failures = 0
+        self.probing = False
+        if self.state != self.CLOSED:
+            self.cooldown = BREAKER_COOLDOWN
+            self.transition(self.CLOSED, "探测成功")
+
+    def record_failure(self, error):
+        if not is_key_failure(error):
+            # 请求已送达且有响应，说明密钥本身可用
+            self.record_success()
+            return
+        self.failures += 1
+        auth_error = isinstance(error, APIError) and error.status in (401, 403)
+        if self.state == self.HALF_OPEN:
+            self.cooldown = min(self.cooldown * 2, BREAKER_MAX_COOLDOWN)
+            self.open(error, auth_error)
+        elif self.state == self.CLOSED and self.failures >= KEY_MAX_FAILURES:
+            self.open(error, auth_error)
+
+    def open(self, error, auth_error):
+        cooldown = max(self.cooldown, BREAKER_AUTH_COOLDOWN) if auth_error else self.cooldown
+        self.open_until = time.monotonic() + cooldown
+        self.probing = False
+        self.transition(self.OPEN, f"连续失败 {self.failures} 次，冷却 {cooldown:.0f} 秒 ({error})")
+
+class TranslationJob:
+    """共享队列中的一次批次请求，future 的结果为 ({下标: 译文}, 异常或 None)"""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.future = asyncio.get_running_loop().create_future()
+        self.started = None
+        self.running = set()  # 正在执行该批次的密钥下标
+
+class TranslationScheduler:
+    """整次运行共享一个工作队列的调度器
+
+    每个密钥启动 concurrency 个工作协程，空闲时主动从队列领取批次，
+    因此吞吐取决于所有密钥的总能力而非最慢的密钥；失败的密钥由熔断器
+    暂停领取，工作自动流向健康的密钥；执行时间远超近期请求耗时分布的批次
+    会被其他空闲密钥重复领取，先完成者生效。
+    """
+
+    def __init__(self, translators, engine, cache, concurrency=KEY_CONCURRENCY):
+        self.translators = translators
+        self.engine = engine
+        self.cache = cache
+        self.concurrency = concurrency
+        self.queue = None
+        self.workers = []
+        self.inflight = set()
+        self.health = [KeyHealth(f"密钥 {i + 1}") for i in range(len(translators))]
+        self.stats = {"jobs": 0, "reassigned": 0, "normalized": 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)  # 最近成功请求的耗时秒数
+        self.template_filled = set()
+        self.template_paid = set()
+        self.variants = {}
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        for index in range(len(self.translators)):
+            for _ in range(self.concurrency):
+                self.workers.append(asyncio.create_task(self.worker(index)))
+
+    async def close(self):
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    def lookup(self, key, raw_key):
+        cached = self.cache.get(key)
+        if cached is None and raw_key != key:
+            # 兼容规范化之前写入的缓存条目
+            cached = self.cache.get(raw_key)
+        return cached
+
+    def resolve_source(self, tag, text):
+        """按 translate 的顺序在本地确定条目译文的来源，返回 (来源键, 译文)
+
+        来源键为缓存键或 glossary:术语（模糊记忆复用的译文已写回缓存）；仍需请求时返回 None。
+        """
+        entries = self.cache.entries
+        key = keep_key(text)
+        if key in entries:
+            return key, entries[key]
+        if glossary is not None:
+            term = glossary.match(text)
+            if term is not None:
+                return f"glossary:{term}", glossary.terms[term]
+        for key in (cache_key(tag, text), f"{tag}:{text}"):
+            if key in entries:
+                return key, entries[key]
+        if TEMPLATE_CACHE:
+            template, values = make_template(normalize_text(text))
+            if values and cache_key(tag, template) in entries:
+                key = cache_key(tag, template)
+                return key, entries[key]
+        return None
+
+    def source_value(self, key):
+        if key.startswith("glossary:"):
+            return glossary.terms.get(key[len("glossary:"):]) if glossary is not None else None
+        return self.cache.entries.get(key)
+
+    def fingerprint(self, sources):
+        """来源键及其当前译文的哈希，任何一条译文变化或缺失都会改变结果"""
+        digest = hashlib.sha256()
+        for key in sources:
+            value = self.source_value(key)
+            if value is None:
+                return None
+            digest.update(f"{key}\0{value}\0".encode("utf-8"))
+        return digest.hexdigest()
+
+    def note_variant(self, key, raw_key):
+        """记录本次运行中同一规范化键出现过的原始写法，新写法即为规范化省下的一次请求"""
+        seen = self.variants.setdefault(key, set())
+        if seen and raw_key not in seen:
+            self.stats["normalized"] += 1
+        seen.add(raw_key)
+
+    async def translate(self, entries, use_templates=None):
+        """翻译 [(tag, text, context), ...]，返回 [(tag, text, translated, context), ...]
+
+        含数字、尺寸或版本号的条目改为请求其模板，取回后在本地填回原值；
+        模板多次校验失败的条目最后按原文单独再翻译一轮。
+        """
+        if use_templates is None:
+            use_templates = TEMPLATE_CACHE
+        single_flight = self.engine.single_flight
+        translations = {}
+        templates = {}  # 缓存键 -> (模板缓存键, 被替换的原值)
+        pending = {}  # 由本次调用负责请求的条目，键为请求的缓存键
+        waiting = {}  # 其他调用正在请求的条目
+        keys = []
+        reusable = {}
+        if self.cache.memory is not None:
+            # 未命中缓存、也不走模板的条目先在线程池中批量做模糊检索，不占用事件循环
+            candidates = {}
+            for tag, text, context in entries:
+                key = cache_key(tag, text)
+                request_text = normalize_text(text)
+                if (key not in candidates and self.lookup(key, f"{tag}:{text}") is None
+                        and not (use_templates and make_template(request_text)[1])):
+                    candidates[key] = (tag, request_text)
+            if candidates:
+                reusable = await asyncio.get_running_loop().run_in_executor(
+                    None, self.cache.memory.reuse_many, candidates)
+        for tag, text, context in entries:
+            key = cache_key(tag, text)
+            keys.append(key)
+            self.note_variant(key, f"{tag}:{text}")
+            if key in translations or key in templates:
+                continue
+            if self.cache.get(keep_key(text)) is not None:
+                # 模型曾原样返回的原文，不再请求
+                self.cache.count_lookup(True)
+                skip_stats["unchanged"] += 1
+                translations[key] = normalize_text(text)
+                continue
+            if glossary is not None:
+                translated = glossary.lookup(text)
+                if translated is not None:
+                    translations[key] = translated
+                    continue
+            cached = self.lookup(key, f"{tag}:{text}")
+            if cached is not None:
+                self.cache.count_lookup(True)
+                translations[key] = cached
+                continue
+
+            request_key, request_text = key, normalize_text(text)
+            template, values = make_template(request_text) if use_templates else (request_text, [])
+            if values:
+                request_key, request_text = cache_key(tag, template), template
+                templates[key] = (request_key, values)
+                cached = self.cache.get(request_key)
+                self.cache.count_lookup(cached is not None)
+                if cached is not None:
+                    translations[request_key] = cached
+                if cached is not None or request_key in pending or request_key in waiting:
+                    # 同一模板已翻译或正在翻译，本条不再单独请求
+                    continue
+            else:
+                self.cache.count_lookup(False)
+                if key in pending or key in waiting:
+                    continue
+                reused = reusable.get(key)
+                if reused is not None:
+                    # 写回本条自己的缓存键，之后按精确命中处理，清单也能确定译文来源
+                    self.cache.update({key: reused})
+                    translations[key] = reused
+                    continue
+
+            future, leader = single_flight.claim(request_key)
+            if leader:
+                pending[request_key] = (tag, request_text, context)
+            else:
+                waiting[request_key] = future
+
+        try:
+            chunks = pack_batches(list(pending.values()))
+            for chunk_results in await asyncio.gather(*(self.translate_chunk(chunk) for chunk in chunks)):
+                translations.update(chunk_results)
+        finally:
+            # 先交付自己负责的结果再等待别人，避免互相等待
+            for key in pending:
+                single_flight.resolve(key, translations.get(key))
+
+        for key, future in waiting.items():
+            translated = await future
+            if translated is not None:
+                translations[key] = translated
+
+        fallback = []
+        filled = set()
+        for (tag, text, context), key in zip(entries, keys):
+            if key in templates and key not in translations:
+                template_key, values = templates[key]
+                if template_key in translations:
+                    translations[key] = fill_template(translations[template_key], values)
+                    filled.add(key)
+                else:
+                    fallback.append((tag, text, context))
+        # 每个模板只算一次请求，其余靠模板填回的不同条目都是省下的请求
+        self.template_filled.update(filled)
+        self.template_paid.update({templates[key][0] for key in filled} & set(pending))
+        if fallback:
+            for tag, text, translated, context in await self.translate(fallback, use_templates=False):
+                translations.setdefault(cache_key(tag, text), translated)
+
         results = []
-        for tag, text, context in batch:
-            translated = translator.translate_text(tag, text)
-            results.append((tag, text, translated, context))
+        for (tag, text, context), key in zip(entries, keys):
+            translated = translations.get(key)
+            results.append((tag, text, translated or text, context))
         return results
-    except Exception as e:
-        print(f"批量翻译失败: {str(e)}")
-        return [(item[0], item[1], item[1], item[2]) for item in batch]
+
+    async def translate_chunk(self, entries):
+        """反复提交同一批次直到全部完成，缺失的条目重新入队，多次失败后拆成单条"""
+        results = {}
+        attempt = 0
+        while entries:
+            if not self.available():
+                print(f"没有可用的密钥，{len(entries)} 条保留原文")
+                break
+            if attempt >= MAX_RETRIES:
+                if len(entries) > 1:
+                    for single in await asyncio.gather(*(self.translate_chunk([entry]) for entry in entries)):
+                        results.update(single)
+                else:
+                    print(f"逐条翻译失败，保留原文 (Tag: {entries[0][0]}, Original: {entries[0][1]})")
+                break
+
+            job = TranslationJob(entries)
+            self.stats["jobs"] += 1
+            self.queue.put_nowait(job)
+            translated, error = await job.future
+            for i, text in translated.items():
+                results[cache_key(*entries[i][:2])] = text
+            entries = [entry for i, entry in enumerate(entries) if i not in translated]
+            if entries:
+                attempt += 1
+                if error is not None:
+                    await asyncio.sleep(retry_delay(error, attempt - 1))
+        return results
+
+    async def worker(self, index):
+        translator = self.translators[index]
+        health = self.health[index]
+        while True:
+            if not health.allow():
+                await asyncio.sleep(STRAGGLER_CHECK_SECONDS)
+                continue
+            await translator.limiter.wait_ready()
+            try:
+                job = await asyncio.wait_for(self.queue.get(), STRAGGLER_CHECK_SECONDS)
+            except asyncio.TimeoutError:
+                job = self.find_straggler(index)
+                if job is None:
+                    health.release()
+                    continue
+                self.stats["reassigned"] += 1
+            await self.run_job(index, job)
+
+    def straggler_cutoff(self):
+        """批次执行超过该秒数才算过久；样本不足时返回 None"""
+        if len(self.latencies) < STRAGGLER_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * STRAGGLER_PERCENTILE))] * STRAGGLER_FACTOR
+
+    def find_straggler(self, index):
+        """找一个运行过久、且尚未由本密钥执行的批次来重复执行"""
+        cutoff = self.straggler_cutoff()
+        if cutoff is None:
+            return None
+        now = time.monotonic()
+        for job in self.inflight:
+            if (not job.future.done() and index not in job.running and len(job.running) < 2
+                    and now - job.started > cutoff):
+                return job
+        return None
+
+    async def run_job(self, index, job):
+        if job.future.done():
+            self.health[index].release()
+            return
+        translator = self.translators[index]
+        job.running.add(index)
+        if job.started is None:
+            job.started = time.monotonic()
+            self.inflight.add(job)
+        start = time.monotonic()
+        try:
+            translated = await translator.request_translations([(tag, text) for tag, text, _ in job.entries])
+            error = None
+            self.latencies.append(time.monotonic() - start)
+            self.health[index].record_success()
+        except Exception as e:
+            translated = {}
+            error = e
+            print(f"密钥 {index + 1} 批量翻译失败: {e}")
+            self.record_failure(index, e)
+        finally:
+            job.running.discard(index)
+
+        # 重复执行时先完成者生效；失败的副本等待仍在运行的副本
+        if job.future.done() or (error is not None and job.running):
+            return
+        self.inflight.discard(job)
+        job.future.set_result((translated, error))
+
+    def available(self):
+        """是否还有密钥能在 BREAKER_MAX_WAIT 秒内恢复工作"""
+        return any(health.retry_in() <= BREAKER_MAX_WAIT for health in self.health)
+
+    def record_failure(self, index, error):
+        self.health[index].record_failure(error)
+        if not self.available():
+            # 所有密钥都已长时间熔断，结束队列中等待的批次
+            while not self.queue.empty():
+                job = self.queue.get_nowait()
+                if not job.future.done():
+                    job.future.set_result(({}, error))
+
+    def summary(self):
+        cutoff = self.straggler_cutoff()
+        lines = [f"调度批次 {self.stats['jobs']} 个, 重新分配 {self.stats['reassigned']} 个 "
+                 f"(判定过久: {f'{cutoff:.1f} 秒' if cutoff is not None else '样本不足'}), "
+                 f"规范化缓存键节省请求 {self.stats['normalized']} 条, "
+                 f"模板缓存节省请求 {len(self.template_filled) - len(self.template_paid)} 条\n"]
+        for health in self.health:
+            lines.append(f"{health.name}: 当前状态 {health.state}\n")
+            for timestamp, old, new, reason in health.transitions:
+                lines.append(f"  [{timestamp}] {old} -> {new} {reason}\n")
+        return "".join(lines)
+
+def estimate_tokens(text):
+    """粗略估计 token 数：中日韩字符约 1 token/字，其余约 4 字符/token"""
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def entry_token_cost(text):
+    """返回条目的 (输入, 输出) token 估计"""
+    tokens = estimate_tokens(text) + ENTRY_TOKEN_OVERHEAD
+    return tokens, int(tokens * OUTPUT_TOKEN_RATIO) + ENTRY_TOKEN_OVERHEAD
+
+def hint_token_budget():
+    return min(HINT_TOKEN_BUDGET, MAX_INPUT_TOKENS // 4)
+
+def build_hints(sections):
+    """拼接提示段落 [(标题, [(原文, 译文), ...]), ...]，总量不超过 hint_token_budget()，放不下的条目舍弃"""
+    budget = hint_token_budget()
+    parts = []
+    used = 0
+    for title, pairs in sections:
+        lines = []
+        cost = estimate_tokens(title)
+        for source, translated in pairs:
+            line = f"{source} => {translated}\n"
+            if used + cost + estimate_tokens(line) > budget:
+                break
+            lines.append(line)
+            cost += estimate_tokens(line)
+        if lines:
+            parts.append(title + "".join(lines))
+            used += cost
+    return "".join(parts)
+
+def pack_batches(entries):
+    """按 token 预算装箱（首次适应递减），单条超出预算的条目单独成批
+
+    输入预算扣除固定提示词和 hint_token_budget()，注入术语和参考译文后整批仍不超过 MAX_INPUT_TOKENS。
+    """
+    input_budget = max(1, MAX_INPUT_TOKENS - estimate_tokens(BATCH_PROMPT + SOURCE_MARKER) - hint_token_budget())
+    bins = []  # [输入已用, 输出已用, 条目列表]
+    oversized = []
+    costed = sorted(((entry_token_cost(entry[1]), entry) for entry in entries),
+                    key=lambda item: item[0], reverse=True)
+    for (cost_in, cost_out), entry in costed:
+        if cost_in > input_budget or cost_out > MAX_OUTPUT_TOKENS:
+            oversized.append([entry])
+            continue
+        for b in bins:
+            if (len(b[2]) < BATCH_SIZE and b[0] + cost_in <= input_budget
+                    and b[1] + cost_out <= MAX_OUTPUT_TOKENS):
+                b[0] += cost_in
+                b[1] += cost_out
+                b[2].append(entry)
+                break
+        else:
+            bins.append([cost_in, cost_out, [entry]])
+    return [b[2] for b in bins] + oversized
 
 def log_translation(mod_id, original, translated, file_path, status="Success", error=None):
     global translation_stats
@@ -259,51 +1997,320 @@ def log_translation(mod_id, original, translated, file_path, status="Success", e
     except Exception as e:
         print(f"日志写入失败: {e}")
 
-def process_file(mod_id, file_path, translators, add_language_tag):
+def mod_fingerprint(mod_path):
+    """返回 (mod 目录树的汇总哈希, .sbc/.resx 文件路径列表)
+
+    哈希包含各目录的修改时间，以及每个 .sbc/.resx 的相对路径、大小和修改时间。不读取文件内容；
+    Windows 上 DirEntry.stat() 直接取自目录列表，几乎没有额外开销。mod 有变化时直接处理这里收集的
+    文件列表，不再遍历第二次。
+    """
+    digest = hashlib.sha256()
+    files = []
+    stack = [mod_path]
+    while stack:
+        path = stack.pop()
+        digest.update(f"{os.path.relpath(path, mod_path)}\0{os.stat(path).st_mtime_ns}\0".encode("utf-8"))
+        with os.scandir(path) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        for entry in entries:
+            # 与 os.walk 一致：文件的符号链接按目标处理，目录的符号链接不进入
+            if entry.is_file() and entry.name.endswith(('.sbc', '.resx')):
+                stat = entry.stat()
+                digest.update(f"{os.path.relpath(entry.path, mod_path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0"
+                              .encode("utf-8"))
+                files.append(entry.path)
+        stack.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+    return digest.hexdigest(), files
+
+class FileManifest:
+    """已处理文件的清单，按相对 MOD_FOLDER 的路径记录源文件哈希、大小/修改时间、解析器版本、
+    输出文件以及所用译文的来源键和哈希
+
+    源文件和它用到的译文都没有变化时，下次运行直接跳过该文件，不备份、不解析、不写回。
+    大小和修改时间一致即视为未变化；不一致时再比较内容哈希，只是被 touch 过的文件同样跳过。
+    全部文件都处理成功的 mod 另外记录目录指纹，指纹不变时整个 mod 不再遍历。
+    """
+
+    def __init__(self, path, skip=True):
+        self.path = path
+        self.skip = skip
+        self.lock = threading.Lock()
+        self.files = {}
+        self.mods = {}
+        self.journal = None  # 可选的 RunJournal，新记录同时追加到日志
+        self.stats = {"skipped": 0, "hashed": 0, "recorded": 0, "mods_skipped": 0, "seconds_saved": 0.0}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.files = data.get("files", {})
+                self.mods = data.get("mods", {})
+            except Exception as e:
+                print(f"清单读取失败，全部文件重新处理: {e}")
+
+    def mod_unchanged(self, mod_id, fingerprint, add_language_tag, scheduler):
+        """目录指纹未变且 mod 内每个文件的清单记录仍然有效时返回 True，只查看清单和输出文件"""
+        record = self.mods.get(mod_id)
+        if not self.skip or record is None or record["parser"] != PARSER_VERSION:
+            return False
+        if record["fingerprint"] != fingerprint or record["add_language_tag"] != add_language_tag:
+            return False
+        for rel_path in record["files"]:
+            entry = self.files.get(rel_path)
+            if entry is None or entry["parser"] != PARSER_VERSION:
+                return False
+            if entry["output"] and not os.path.exists(os.path.join(output_folder, entry["output"])):
+                return False
+            if entry["translations"] != scheduler.fingerprint(entry["sources"]):
+                return False
+        self.stats["mods_skipped"] += 1
+        self.stats["seconds_saved"] += record["seconds"]
+        return True
+
+    def record_mod(self, mod_id, fingerprint, add_language_tag, rel_paths, seconds):
+        """mod 内所有文件都已记录（处理成功或未变化）时才记录指纹"""
+        with self.lock:
+            if any(rel_path not in self.files for rel_path in rel_paths):
+                self.mods.pop(mod_id, None)
+                return
+            self.mods[mod_id] = {
+                "fingerprint": fingerprint,
+                "parser": PARSER_VERSION,
+                "add_language_tag": add_language_tag,
+                "files": rel_paths,
+                "seconds": seconds,
+            }
+
+    def unchanged(self, rel_path, stat, output_path, scheduler, digest=None):
+        """digest 为空时只比较大小和修改时间，否则比较内容哈希"""
+        record = self.files.get(rel_path)
+        if not self.skip or record is None or record["parser"] != PARSER_VERSION:
+            return False
+        if record["output"]:  # 没有可翻译内容的文件不产生输出
+            if record["output"] != os.path.relpath(output_path, output_folder) or not os.path.exists(output_path):
+                return False
+        if digest is None:
+            if (record["size"], record["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+                return False
+        elif record["sha256"] != digest:
+            return False
+        if record["translations"] != scheduler.fingerprint(record["sources"]):
+            return False
+
+        with self.lock:
+            self.stats["skipped"] += 1
+            if digest is not None:
+                self.stats["hashed"] += 1
+                record["size"], record["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+        return True
+
+    def known(self, rel_path):
+        return self.skip and rel_path in self.files
+
+    def record(self, rel_path, stat, digest, output_path, scheduler, entries):
+        """entries 为空表示文件没有可翻译内容；有条目译文无法由缓存确定（翻译失败等）时不记录"""
+        sources = []
+        for tag, text, context in entries:
+            source = scheduler.resolve_source(tag, text)
+            if source is None:
+                with self.lock:
+                    self.files.pop(rel_path, None)
+                return
+            sources.append(source[0])
+        record = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": digest,
+            "parser": PARSER_VERSION,
+            "output": os.path.relpath(output_path, output_folder) if entries else "",
+            "sources": sources,
+            "translations": scheduler.fingerprint(sources),
+        }
+        with self.lock:
+            self.files[rel_path] = record
+            self.stats["recorded"] += 1
+        if self.journal is not None:
+            self.journal.add_file(rel_path, record)
+
+    def save(self):
+        with self.lock:
+            data = json.dumps({"files": self.files, "mods": self.mods}, ensure_ascii=False)
+        try:
+            replace_atomically(self.path, lambda f: f.write(data))
+        except Exception as e:
+            print(f"清单保存失败: {e}")
+
+    def summary(self):
+        return (f"增量: 跳过未变化的 mod {self.stats['mods_skipped']} 个 (估计节省 {self.stats['seconds_saved']:.2f} 秒), "
+                f"跳过未变化的文件 {self.stats['skipped']} 个 (其中按内容哈希确认 {self.stats['hashed']} 个), "
+                f"本次记录 {self.stats['recorded']} 个, 清单共 {len(self.files)} 个\n")
+
+class RunJournal:
+    """本次运行的追加式日志：每批新译文和每个完成的文件各追加一行 JSON，写入后立即 flush
+
+    运行被中断时日志保留下来；下次以 --resume 启动时，其中的译文补进缓存、完成的文件补进清单，
+    已完成的文件不再解析，已取回的条目不再请求。正常结束时删除日志。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+        self.stats = {"entries": 0, "files": 0}
+
+    def replay(self):
+        """读出上次运行的日志，返回 (译文, 完成文件的清单记录)"""
+        entries, files = {}, {}
+        if not os.path.exists(self.path):
+            return entries, files
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 中断时只写了一半的行
+                if "file" in record:
+                    files[record["file"]] = record["record"]
+                else:
+                    entries.update(record["entries"])
+        self.stats["entries"], self.stats["files"] = len(entries), len(files)
+        return entries, files
+
+    def open(self, resume):
+        if resume:
+            partial = False
+            if os.path.exists(self.path) and os.path.getsize(self.path):
+                with open(self.path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    partial = f.read(1) != b"\n"
+            self.file = open(self.path, "a", encoding="utf-8")
+            if partial:
+                self.file.write("\n")  # 隔开中断时写了一半的行
+        else:
+            if os.path.exists(self.path):
+                print(f"发现上次中断运行的日志 {self.path}，未指定 --resume，将重新开始")
+            self.file = open(self.path, "w", encoding="utf-8")
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def add_entries(self, items):
+        self.write({"entries": items})
+
+    def add_file(self, rel_path, record):
+        self.write({"file": rel_path, "record": record})
+
+    def close(self, remove=False):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def summary(self):
+        return f"续译: 从日志恢复译文 {self.stats['entries']} 条, 已完成文件 {self.stats['files']} 个\n"
+
+class PreparedFile:
+    """已读取并解析、等待翻译的文件，document 保持打开直到写回"""
+
+    def __init__(self, file_path, rel_path, stat, output_path, document, matches):
+        self.file_path = file_path
+        self.rel_path = rel_path
+        self.stat = stat
+        self.output_path = output_path
+        self.document = document
+        self.matches = matches
+
+def prepare_file(mod_id, file_path, scheduler, add_language_tag, manifest, backups):
+    """在文件线程中完成备份、增量判断和解析；需要翻译时返回 PreparedFile，否则返回 None"""
+    document = None
     try:
-        backup_path = os.path.join(BACKUP_FOLDER, os.path.relpath(file_path, MOD_FOLDER))
-        os.makedirs(os.path.dirname(backup_path), exist_ok=True)
-        with open(file_path, "rb") as src, open(backup_path, "wb") as dst:
-            dst.write(src.read())
+        rel_path = os.path.relpath(file_path, MOD_FOLDER)
+        output_path = output_path_for(file_path, add_language_tag)
+        stat = os.stat(file_path)
+        if manifest.unchanged(rel_path, stat, output_path, scheduler):
+            backups.note(rel_path, manifest.files[rel_path]["sha256"])
+            return None
 
-        matches = parse_translatable_content(file_path)
+        document = LoadedDocument(file_path)
+        backups.put(document, rel_path)
+        if manifest.known(rel_path) and manifest.unchanged(rel_path, stat, output_path, scheduler, document.digest):
+            document.close()
+            return None
+
+        matches = parse_translatable_content(document)
         if not matches:
             print(f"警告: 文件 {file_path} 没有可翻译内容。")
-            return
-
-        batches = [matches[i::len(translators)] for i in range(len(translators))]
-        all_translations = []
-
-        with ThreadPoolExecutor(max_workers=len(translators)) as executor:
-            futures = []
-            for i, batch in enumerate(batches):
-                if batch:
-                    futures.append(executor.submit(
-                        process_batch, 
-                        translators[i], 
-                        batch, 
-                        mod_id, 
-                        file_path
-                    ))
-
-            for future in as_completed(futures):
-                batch_result = future.result()
-                all_translations.extend(batch_result)
-                for item in batch_result:
-                    log_translation(mod_id, item[1], item[2], file_path)
-
-        replace_translated_content(file_path, all_translations, add_language_tag)
+            manifest.record(rel_path, stat, document.digest, output_path, scheduler, [])
+            document.close()
+            return None
+        return PreparedFile(file_path, rel_path, stat, output_path, document, matches)
 
     except Exception as e:
+        if document is not None:
+            document.close()
         log_translation(mod_id, "", "", file_path, "Failed", str(e))
         traceback.print_exc()
+        return None
 
-def process_batch(translator, batch, mod_id, file_path):
+def finish_file(mod_id, prepared, translating, scheduler, add_language_tag, manifest):
+    """翻译完成后写回译文并记入清单"""
     try:
-        return batch_translate(translator, batch)
+        all_translations = translating.result()
+        for item in all_translations:
+            log_translation(mod_id, item[1], item[2], prepared.file_path)
+
+        replace_translated_content(prepared.document, all_translations, add_language_tag)
+        manifest.record(prepared.rel_path, prepared.stat, prepared.document.digest, prepared.output_path,
+                        scheduler, prepared.matches)
+
     except Exception as e:
-        print(f"批处理失败: {str(e)}")
-        return [(item[0], item[1], item[1], item[2]) for item in batch]
+        log_translation(mod_id, "", "", prepared.file_path, "Failed", str(e))
+        traceback.print_exc()
+    finally:
+        prepared.document.close()
+
+def process_files(mod_id, files, scheduler, add_language_tag, manifest, backups):
+    """文件线程只负责读取、解析和写回；每个文件的翻译协程提交给引擎后不等待，
+    所有文件的批次同时进入共享队列，在途请求数只受密钥数和 --key-concurrency 限制"""
+    with ThreadPoolExecutor(max_workers=FILE_WORKERS) as executor, \
+            tqdm(total=len(files), desc=mod_id) as progress:
+        parsing = [executor.submit(prepare_file, mod_id, f, scheduler, add_language_tag, manifest, backups)
+                   for f in files]
+        translating = {}
+        for future in as_completed(parsing):
+            prepared = future.result()
+            if prepared is None:
+                progress.update(1)
+                continue
+            translating[scheduler.engine.submit(scheduler.translate(prepared.matches))] = prepared
+        writing = [executor.submit(finish_file, mod_id, translating[future], future, scheduler,
+                                   add_language_tag, manifest)
+                   for future in as_completed(translating)]
+        for future in as_completed(writing):
+            future.result()
+            progress.update(1)
+
+def connection_summary(translators):
+    lines = []
+    total_requests = total_handshakes = 0
+    for i, translator in enumerate(translators):
+        requests_sent, handshakes = translator.connection_stats()
+        total_requests += requests_sent
+        total_handshakes += handshakes
+        reuse = 1 - handshakes / requests_sent if requests_sent else 0
+        limiter = translator.limiter
+        lines.append(f"密钥 {i + 1}: 请求 {requests_sent} 次, 握手 {handshakes} 次, 连接复用率 {reuse:.1%}, "
+                     f"限流 {limiter.throttled} 次, 当前速率 {limiter.scale:.0%}\n")
+    reuse = 1 - total_handshakes / total_requests if total_requests else 0
+    lines.append(f"合计: 请求 {total_requests} 次, 握手 {total_handshakes} 次, 连接复用率 {reuse:.1%}\n")
+    return "".join(lines)
 
 def generate_api_config():
     default_config = {
@@ -313,7 +2320,9 @@ def generate_api_config():
             " "
         ],
         "api_url": "在此处填入URL",
-        "__usage_instructions__": "一行一个，可多行，推荐阿里云百炼 API。API 数量越多，翻译速度越快。请将实际的 API 密钥和 URL 填写到对应位置。"
+        "requests_per_minute": REQUESTS_PER_MINUTE,
+        "tokens_per_minute": TOKENS_PER_MINUTE,
+        "__usage_instructions__": "一行一个，可多行，推荐阿里云百炼 API。API 数量越多，翻译速度越快。请将实际的 API 密钥和 URL 填写到对应位置。requests_per_minute / tokens_per_minute 为每个密钥的配额，遇到限流时会自动降速。"
     }
     with open(CONFIG_FILE, "w", encoding="utf-8") as f:
         json.dump(default_config, f, ensure_ascii=False, indent=2)
@@ -347,23 +2356,88 @@ def load_api_config():
         print("警告: API密钥和URL尚未修改。请修改 api_config.json 文件中的 API 密钥和 URL 后重试。")
         exit(1)
     
-    return api_keys, api_url
+    rate_limits = (
+        config.get("requests_per_minute", REQUESTS_PER_MINUTE),
+        config.get("tokens_per_minute", TOKENS_PER_MINUTE)
+    )
+    return api_keys, api_url, rate_limits
 
 def main():
+    global BATCH_SIZE, MAX_INPUT_TOKENS, MAX_OUTPUT_TOKENS, FOLD_TAGS, TEMPLATE_CACHE, glossary
     parser = argparse.ArgumentParser()
     parser.add_argument('--add-language-tag', action='store_true')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='每次 API 请求打包翻译的条目数')
+    parser.add_argument('--key-concurrency', type=int, default=KEY_CONCURRENCY,
+                        help='每个 API 密钥同时在途的请求数')
+    parser.add_argument('--cache-backend', choices=['sqlite', 'json'], default='sqlite',
+                        help='翻译缓存的存储格式')
+    parser.add_argument('--fold-tags', action='store_true',
+                        help='Tooltip 与 DisplayName 共用缓存条目')
+    parser.add_argument('--no-template-cache', action='store_true',
+                        help='不把只有数字不同的条目合并为模板翻译')
+    parser.add_argument('--no-fuzzy-memory', action='store_true',
+                        help='不使用相似原文的已有译文')
+    parser.add_argument('--glossary', default=GLOSSARY_FILE,
+                        help='用户术语表 JSON 文件（原文 -> 译文），叠加在内置术语表之上')
+    parser.add_argument('--max-input-tokens', type=int, default=MAX_INPUT_TOKENS,
+                        help='每次 API 请求待翻译内容的 token 预算')
+    parser.add_argument('--max-output-tokens', type=int, default=MAX_OUTPUT_TOKENS,
+                        help='每次 API 请求译文的 token 预算')
+    parser.add_argument('--force', action='store_true',
+                        help='忽略清单，重新处理所有文件')
+    parser.add_argument('--resume', action='store_true',
+                        help='从上次中断的运行继续，复用日志中已完成的文件和译文')
+    parser.add_argument('--list-backups', action='store_true',
+                        help='列出可恢复的备份索引后退出')
+    parser.add_argument('--restore-backup', metavar='RUN',
+                        help='把 mod 文件恢复为某次运行时的备份（索引名或 latest）后退出')
     args = parser.parse_args()
+
+    BATCH_SIZE = max(1, args.batch_size)
+    MAX_INPUT_TOKENS = args.max_input_tokens
+    MAX_OUTPUT_TOKENS = args.max_output_tokens
+    FOLD_TAGS = args.fold_tags
+    TEMPLATE_CACHE = not args.no_template_cache
+    glossary = load_glossary(args.glossary)
     
     os.makedirs(output_folder, exist_ok=True)
     os.makedirs(BACKUP_FOLDER, exist_ok=True)
+    backups = BackupStore(BACKUP_FOLDER)
+    if args.list_backups:
+        print("\n".join(backups.list_runs()) or "没有备份索引")
+        return
+    if args.restore_backup:
+        backups.restore(args.restore_backup)
+        return
 
     # 检查并创建 OUTPUT_FOLDER 文件夹
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
         print(f"已创建翻译文件夹: {output_folder}")
 
-    api_keys, api_url = load_api_config()
-    translators = [AlibabaBatchTranslator(k, api_url) for k in api_keys]
+    api_keys, api_url, rate_limits = load_api_config()
+    engine = AsyncTranslationEngine()
+    key_concurrency = max(1, args.key_concurrency)
+    store = SqliteTranslationCache(CACHE_DB_FILE) if args.cache_backend == 'sqlite' else JsonCacheStore(CACHE_FILE)
+    cache = TranslationCache(store)
+    if not args.no_fuzzy_memory:
+        cache.memory = TranslationMemory(cache)
+    # 包括 Ctrl-C 在内的任何退出都会写完缓冲区
+    atexit.register(cache.close)
+    translators = [AlibabaBatchTranslator(k, api_url, engine, cache, key_concurrency, *rate_limits) for k in api_keys]
+    scheduler = TranslationScheduler(translators, engine, cache, key_concurrency)
+    engine.run(scheduler.start())
+    manifest = FileManifest(MANIFEST_FILE, skip=not args.force)
+    journal = RunJournal(JOURNAL_FILE)
+    if args.resume:
+        entries, files = journal.replay()
+        cache.update({key: value for key, value in entries.items() if cache.entries.get(key) != value})
+        manifest.files.update(files)
+        print(f"续译: 从日志恢复译文 {len(entries)} 条, 已完成文件 {len(files)} 个")
+    journal.open(args.resume)
+    cache.journal = journal
+    manifest.journal = journal
     mod_ids = load_mod_ids(MOD_ID_LIST_FILE)
 
     # 检查modid.txt文件内容是否被修改
@@ -394,20 +2468,24 @@ def main():
         mod_path = os.path.join(MOD_FOLDER, mod_id)
         if not os.path.exists(mod_path):
             continue
+        mod_start = time.time()
+        fingerprint, files = mod_fingerprint(mod_path)
+        if manifest.mod_unchanged(mod_id, fingerprint, args.add_language_tag, scheduler):
+            for rel_path in manifest.mods[mod_id]["files"]:
+                backups.note(rel_path, manifest.files[rel_path]["sha256"])
+            continue
 
-        files = []
-        for root, _, filenames in os.walk(mod_path):
-            files.extend(os.path.join(root, f) 
-                for f in filenames if f.endswith(('.sbc', '.resx')))
-
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            futures = [executor.submit(process_file, mod_id, f, translators, args.add_language_tag) 
-                      for f in files]
-            for future in tqdm(as_completed(futures), total=len(files), desc=mod_id):
-                future.result()
+        process_files(mod_id, files, scheduler, args.add_language_tag, manifest, backups)
+        manifest.record_mod(mod_id, fingerprint, args.add_language_tag,
+                            [os.path.relpath(f, MOD_FOLDER) for f in files], time.time() - mod_start)
 
     end_time = time.time()
     elapsed_time = end_time - start_time
+    cache.flush()
+    manifest.save()
+    backups.save_index(timestamp)
+    # 译文和清单都已落盘，日志不再需要
+    journal.close(remove=True)
 
     # 记录翻译统计信息
     summary = (
@@ -416,7 +2494,20 @@ def main():
         f"总翻译条目数: {translation_stats['total']}\n"
         f"成功翻译条目数: {translation_stats['success']}\n"
         f"失败翻译条目数: {translation_stats['failed']}\n"
+        f"本地跳过无需翻译的条目: 规则 {skip_stats['rules']} 条, 负缓存 {skip_stats['unchanged']} 条\n"
         f"运行时间: {elapsed_time:.2f} 秒\n"
+        f"{'-'*50}\n"
+        f"{journal.summary() if args.resume else ''}"
+        f"{manifest.summary()}"
+        f"{backups.summary()}"
+        f"{parse_summary()}"
+        f"{encoding_summary()}"
+        f"{connection_summary(translators)}"
+        f"{scheduler.summary()}"
+        f"{engine.single_flight.summary()}"
+        f"{cache.summary()}"
+        f"{glossary.summary()}"
+        f"{cache.memory.summary() if cache.memory else ''}"
         f"{'='*50}\n"
     )
     try:
@@ -425,5 +2516,11 @@ def main():
     except Exception as e:
         print(f"统计信息写入失败: {e}")
 
+    engine.run(scheduler.close())
+    for translator in translators:
+        translator.close()
+    engine.close()
+    cache.close()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,22 @@
+import importlib.util
+import os
+import shutil
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "SETSv0.2.1.py")
+
+
+@pytest.fixture
+def load_sets(tmp_path):
+    """在临时目录载入脚本，modid.txt 等文件都落在临时目录"""
+
+    def load():
+        shutil.copy(SCRIPT, tmp_path / "sets_under_test.py")
+        (tmp_path / "modid.txt").write_text(f"{tmp_path / 'mods'}\n111\n", encoding="utf-8")
+        spec = importlib.util.spec_from_file_location("sets_under_test", tmp_path / "sets_under_test.py")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    return load
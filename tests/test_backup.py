@@ -0,0 +1,27 @@
+"""备份仓库测试"""
+
+import os
+
+import pytest
+
+
+@pytest.fixture
+def sets(load_sets):
+    return load_sets()
+
+
+def test_editing_backup_tree_leaves_stored_object_intact(sets, tmp_path):
+    source = tmp_path / "CubeBlocks.sbc"
+    source.write_bytes(b"<Definitions>original</Definitions>")
+    backups = sets.BackupStore(str(tmp_path / "backup"))
+    with sets.LoadedDocument(str(source)) as document:
+        backups.put(document, os.path.join("111", "Data", "CubeBlocks.sbc"))
+        object_path = backups.object_path(document.digest)
+
+    tree_path = tmp_path / "backup" / "111" / "Data" / "CubeBlocks.sbc"
+    with open(tree_path, "r+b") as f:
+        f.write(b"<Edited")
+
+    with open(object_path, "rb") as f:
+        assert f.read() == b"<Definitions>original</Definitions>"
+    assert os.stat(object_path).st_mode & 0o222 == 0
@@ -0,0 +1,187 @@
+"""异步翻译引擎对本地桩服务器的测试：批量打包、429 与 Retry-After 退避、密钥熔断切换"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+class StubState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []  # (密钥, 原文列表)
+        self.throttle = 0  # 前 throttle 个请求返回 429
+        self.retry_after = "1"
+
+    def keys(self):
+        with self.lock:
+            return [key for key, _ in self.requests]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """模拟 DashScope：译文为 "译" + 原文，密钥含 bad 时返回 401"""
+
+    protocol_version = "HTTP/1.1"
+    state = None
+    marker = None
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body, headers=()):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        key = self.headers["Authorization"].split()[-1]
+        source = payload["input"]["prompt"].split(self.marker, 1)[1]
+        try:
+            texts = json.loads(source)
+        except json.JSONDecodeError:
+            texts = None
+        with self.state.lock:
+            self.state.requests.append((key, list(texts.values()) if texts else [source]))
+            throttled = len(self.state.requests) <= self.state.throttle
+        if "bad" in key:
+            return self.reply(401, '{"message": "invalid key"}')
+        if throttled:
+            return self.reply(429, '{"message": "rate limited"}', [("Retry-After", self.state.retry_after)])
+        if texts:
+            text = json.dumps({k: "译" + v for k, v in texts.items()}, ensure_ascii=False)
+        else:
+            text = "译" + source
+        self.reply(200, json.dumps({"output": {"text": text}}, ensure_ascii=False))
+
+
+@pytest.fixture
+def sets(load_sets, monkeypatch):
+    module = load_sets()
+    monkeypatch.setattr(module, "REQUEST_DELAY", 0.05)
+    monkeypatch.setattr(module, "TEMPLATE_CACHE", False)
+    return module
+
+
+@pytest.fixture
+def stub(sets):
+    state = StubState()
+    handler = type("Handler", (StubHandler,), {"state": state, "marker": sets.SOURCE_MARKER})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    state.url = f"http://127.0.0.1:{server.server_address[1]}/"
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["aiohttp", "threads"])
+def make_scheduler(request, sets, stub, tmp_path, monkeypatch):
+    """按给定密钥建立引擎、缓存和调度器；threads 参数模拟未安装 aiohttp 的环境"""
+    if request.param == "aiohttp" and sets.aiohttp is None:
+        pytest.skip("未安装 aiohttp")
+    if request.param == "threads":
+        monkeypatch.setattr(sets, "aiohttp", None)
+    created = []
+
+    def make(keys, concurrency=2):
+        engine = sets.AsyncTranslationEngine()
+        cache = sets.TranslationCache(sets.JsonCacheStore(str(tmp_path / "cache.json")))
+        translators = [sets.AlibabaBatchTranslator(key, stub.url, engine, cache, concurrency) for key in keys]
+        scheduler = sets.TranslationScheduler(translators, engine, cache, concurrency)
+        engine.run(scheduler.start())
+        created.append((engine, cache, translators, scheduler))
+        return scheduler
+
+    yield make
+    for engine, cache, translators, scheduler in created:
+        engine.run(scheduler.close())
+        for translator in translators:
+            translator.close()
+        engine.close()
+        cache.close()
+
+
+def entries(count):
+    return [("Description", f"Armored hull section {chr(65 + i)}", None) for i in range(count)]
+
+
+def test_batch_packs_entries_into_one_request(sets, stub, make_scheduler):
+    scheduler = make_scheduler(["good"])
+    items = entries(10)
+
+    results = scheduler.engine.run(scheduler.translate(items))
+
+    assert [translated for _, _, translated, _ in results] == ["译" + text for _, text, _ in items]
+    assert len(stub.requests) == 1
+    assert len(stub.requests[0][1]) == 10
+    assert scheduler.cache.get(sets.cache_key("Description", items[0][1])) == "译" + items[0][1]
+
+
+def test_throttled_request_waits_for_retry_after(sets, stub, make_scheduler):
+    stub.throttle = 1
+    scheduler = make_scheduler(["good"])
+
+    start = time.monotonic()
+    results = scheduler.engine.run(scheduler.translate(entries(3)))
+    elapsed = time.monotonic() - start
+
+    assert all(translated.startswith("译") for _, _, translated, _ in results)
+    assert len(stub.requests) == 2
+    assert scheduler.translators[0].limiter.throttled == 1
+    assert elapsed >= 0.9  # Retry-After: 1
+
+
+def test_failing_key_is_opened_and_work_moves_to_healthy_key(sets, stub, make_scheduler, monkeypatch):
+    monkeypatch.setattr(sets, "KEY_MAX_FAILURES", 1)
+    scheduler = make_scheduler(["bad", "good"], concurrency=1)
+
+    results = scheduler.engine.run(scheduler.translate(entries(5)))
+
+    assert all(translated.startswith("译") for _, _, translated, _ in results)
+    assert scheduler.health[0].state == sets.KeyHealth.OPEN
+    assert scheduler.health[1].state == sets.KeyHealth.CLOSED
+    assert "good" in stub.keys()
+
+
+def test_connection_pool_matches_key_concurrency(sets, stub, make_scheduler):
+    scheduler = make_scheduler(["good"], concurrency=1)
+    if sets.aiohttp is None:
+        pytest.skip("线程池回退不使用 aiohttp 连接池")
+
+    scheduler.engine.run(scheduler.translate(entries(1)))
+
+    # limit=0 在 aiohttp 中表示不限制连接数
+    assert scheduler.translators[0].aio_session.connector.limit == 1
+
+
+def test_fuzzy_memory_reuses_near_duplicate_without_request(sets, stub, make_scheduler):
+    scheduler = make_scheduler(["good"])
+    known = "Large reinforced cargo container that stores ore, ingots and components for the ship"
+    scheduler.cache.update({sets.cache_key("Description", known): "大型加固货箱"})
+    scheduler.cache.memory = sets.TranslationMemory(scheduler.cache)
+    while not scheduler.cache.memory.built:
+        time.sleep(0.01)
+
+    results = scheduler.engine.run(scheduler.translate([("Description", known + "!", None)]))
+
+    assert results[0][2] == "大型加固货箱"
+    assert stub.requests == []
+
+
+def test_straggler_cutoff_follows_observed_latency(sets, stub, make_scheduler):
+    scheduler = make_scheduler(["good"])
+    assert scheduler.straggler_cutoff() is None
+
+    scheduler.engine.run(scheduler.translate(entries(1)))
+    assert len(scheduler.latencies) == 1
+
+    scheduler.latencies.extend([2.0] * 98 + [40.0])
+    assert scheduler.straggler_cutoff() == pytest.approx(2.0 * sets.STRAGGLER_FACTOR)
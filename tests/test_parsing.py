@@ -0,0 +1,48 @@
+"""本地过滤规则与解析测试"""
+
+import pytest
+
+
+@pytest.fixture
+def sets(load_sets):
+    return load_sets()
+
+
+@pytest.mark.parametrize("text", [
+    "AutoMiner", "NanoBots", "HoloDeck", "BuildAndRepair", "EasyInventory", "SciFi",
+    "Self-Repair-Module", "Hi-Tech-Armor",
+])
+def test_player_facing_names_are_sent_for_translation(sets, text):
+    assert not sets.is_untranslatable(text)
+
+
+@pytest.mark.parametrize("text", [
+    "LargeBlock_Armor", "largeBlockArmor2", "LargeBlockArmor2x", "Item_Resource.Stone", "Ore-Iron-01",
+    "#FF00FF", "Textures/Icons/Drill.dds",
+])
+def test_identifiers_are_skipped(sets, text):
+    assert sets.is_untranslatable(text)
+
+
+def test_glossary_matches_terms_case_sensitively(sets):
+    glossary = sets.Glossary({"Store": "商店", "Display": "显示器", "Contract": "合同", "Steel Plate": "钢板"})
+
+    assert glossary.relevant(["store ore and display the contract status"]) == []
+    assert glossary.relevant(["Attach a Display to the Steel Plate"]) == [("Display", "显示器"), ("Steel Plate", "钢板")]
+    assert glossary.relevant(["Display the contract status"]) == []
+    assert glossary.lookup("display") is None
+    assert glossary.lookup("Display") == "显示器"
+
+
+def test_splice_keeps_padding_and_crlf_of_source_node(sets, tmp_path):
+    path = tmp_path / "MyTexts.resx"
+    path.write_bytes(b'<root>\r\n  <data name="a">\r\n    <value>\r\n  Line one\r\nLine two\r\n</value>\r\n'
+                     b'  </data>\r\n</root>\r\n')
+    with sets.LoadedDocument(str(path)) as document:
+        [(tag, text, context)] = sets.parse_translatable_content(document)
+        assert text == "Line one\nLine two"
+        output = "".join(sets.splice_translations(document.raw, document.encoding,
+                                                  [(tag, text, "第一行\n第二行", context)]))
+
+    assert output == ('<root>\r\n  <data name="a">\r\n    <value>\r\n  第一行\r\n第二行\r\n</value>\r\n'
+                      '  </data>\r\n</root>\r\n')